@@ -21,4 +21,16 @@
 ##
 from .athspectralscanner import AthSpectralScanner
 from .athspectralscandecoder import AthSpectralScanDecoder
-from .datahub import DataHub
\ No newline at end of file
+from .decodeprojection import DecodeProjection
+from .datahub import DataHub, DumpFileSink
+from .spectrumaggregator import SpectrumAggregator
+from .spectraldensity import SpectralDensity
+from .bandspectrum import BandSpectrum
+from .interferencedetector import InterferenceDetector
+from .tsfclock import TSFClock
+from .dumpindex import DumpIndex, query
+from .decodecache import DecodeCache, CachedSpectra
+from .spectrumserver import SpectrumServer, SpectrumClient
+from .profiling import Profiler, StageTimers
+from .loadcontroller import LoadController
+from .spectrumcodec import CompressedSpectrumSink, SpectrumBatch, read_batches
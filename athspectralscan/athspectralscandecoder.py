@@ -20,9 +20,14 @@
 ## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
 ##
 
+import copy
 import time
+import pickle
 import math
+import queue
 import struct
+import threading
+from time import perf_counter
 from collections import OrderedDict
 import multiprocessing as mp
 from queue import Empty
@@ -50,6 +55,17 @@ class AthSpectralScanDecoder(object):
     the log() can be avoided complete, for instance if the user is only interested in e.g. the TSF values, not in the
     sub carrier pwr info.
 
+    The workers are selected via set_backend():
+    process - (default) worker processes, avoid the GIL. Needs multiprocessing queues
+    thread - worker threads in this process. Useful for free-threaded Python builds, saves the RAM of the processes
+    inline - no workers, the data is decoded in the thread which calls enqueue() (e.g. the reader thread of DataHub)
+
+    end_of_stream() places an end-of-stream marker per worker in the input queue (DataHub does this at the end of a
+    recorded file), so all data enqueued before is decoded. A worker exits at the marker, after all workers have
+    exited, is_finished() becomes True, join() returns and (see set_end_of_stream_marker()) the marker is placed in the
+    output queue, behind all decoded samples. stop() is end_of_stream() + join().
+    Please read the output queue meanwhile, a worker process can not exit before its output is consumed.
+
     Please note, that when using the multiprocessing approach, the samples can be delivered out-of-order!
     """
 
@@ -59,36 +75,191 @@ class AthSpectralScanDecoder(object):
     type2_pktsize = 24 + 128
     type3_pktsize = 26 + 64
 
+    # increase if the decoded values change (invalidates the entries of DecodeCache)
+    decoder_version = 1
+
+    backends = ("process", "thread", "inline")
+    end_of_stream_marker = None  # placed in the input queue (one per worker) and optional in the output queue
+
+    _subcarrier_cache = dict()  # (subcarrier_0, nbins) -> sub-carrier frequencies
+
     def __init__(self, empty_input_queue_timeout_sec=1):
         self.input_queue = mp.Queue()
         self.input_queue_timeout = empty_input_queue_timeout_sec
         self.output_queue = None
-        self.worker_pool = None
+        self.backend = "process"
+        self.workers = []
+        self.running = False
+        self.stream_ended = False
+        self.output_end_marker = False
+        self.finisher = None
         self.number_of_processes = 1
         self.shut_down = mp.Event()
         self.shut_down.clear()
         self.work_done = mp.Event()
         self.work_done.clear()
+        self.workers_finished = mp.Event()
+        self.workers_finished.clear()
         self.disable_pwr_decode = False
+        self.detector = None
+        self.event_queue = None
+        self.forward_samples = True
+        self.projection = None
+        self.profiler = None
+        self.inline_session = None
+        self.load_controller = None
+        self.terminated = False  # the worker processes were terminated by stop(drain=False)
 
     def start(self):
-        if self.output_queue is None:
+        if self.output_queue is None and (self.detector is None or self.event_queue is None):
             logger.warn("no output queue is set. No decoding is done!")
             return
-        self.worker_pool = mp.Pool(processes=self.number_of_processes, initializer=self._decode_data_process,)
+        if not self.forward_samples and self.detector is None:
+            logger.warn("sample forwarding is disabled and no detector is set. No decoding is done!")
+            return
+        if self.projection is not None and self.load_controller is not None:
+            raise Exception("a projection and a load controller can not be combined!")
+        if self.projection is not None and self.detector is not None:
+            raise Exception("a projection and a detector can not be combined! The detector needs the full samples")
+        self.shut_down.clear()
+        self.workers_finished.clear()
+        self.terminated = False
+        self.running = True
+        self.stream_ended = False
+        if self.backend == "inline":
+            return  # the profiling session is started by the first enqueue(), in the thread which decodes
+        for i in range(self.number_of_processes):
+            if self.backend == "process":
+                worker = mp.Process(target=self._decode_data_process, args=())
+            else:
+                # each thread needs its own detector + controller state, a process gets a copy anyway
+                worker = threading.Thread(target=self._decode_data_process,
+                                          args=(copy.deepcopy(self.detector), copy.deepcopy(self.load_controller)))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def __getstate__(self):
+        # the process backend pickles the decoder for each worker under the spawn / forkserver start methods. The
+        # workers (processes, threads) and the profiling session of this process are not needed there
+        state = self.__dict__.copy()
+        state["workers"] = []
+        state["finisher"] = None
+        state["inline_session"] = None
+        return state
+
+    def set_backend(self, backend):
+        if backend not in AthSpectralScanDecoder.backends:
+            raise Exception("unknown backend '%s'. valid: %s" % (backend, ", ".join(AthSpectralScanDecoder.backends)))
+        if self.running:
+            raise Exception("can not change the backend of a running decoder!")
+        self.backend = backend
+        # threads (and inline decoding) do not need to pickle the data
+        self.input_queue = mp.Queue() if backend == "process" else queue.Queue()
 
     def disable_pwr_decoding(self, flag):
         self.disable_pwr_decode = flag
 
+    def set_profiler(self, profiler):
+        # a Profiler: take per-stage timers (and optional cProfile data) in the workers
+        self.profiler = profiler
+
+    def set_load_controller(self, load_controller):
+        # a LoadController: reduce the fidelity of the decoding if the decoder falls behind. Samples get a third
+        # element, the fidelity they were decoded with
+        self.load_controller = load_controller
+
+    def set_projection(self, projection):
+        # a DecodeProjection: decode only the given fields / bins of the samples which match its predicates
+        self.projection = projection
+
+    def set_detector(self, detector):
+        # detector.process(sample) is called for each decoded sample inside the worker(s) and returns a list of events
+        self.detector = detector
+
+    def set_event_queue(self, event_queue):
+        # events of the detector go here. Default: the output queue
+        self.event_queue = event_queue
+
+    def set_forward_samples(self, flag):
+        # disable to get only the detector events, not the decoded samples
+        self.forward_samples = flag
+
     def set_number_of_processes(self, number):
         self.number_of_processes = number
 
+    def set_end_of_stream_marker(self, flag):
+        # enable to get end_of_stream_marker in the output queue, after the last decoded sample
+        self.output_end_marker = flag
+
     def is_finished(self):
-        return self.shut_down.is_set() or self.work_done.is_set()
+        # True if all data before the end of the stream is decoded and placed in the output queue
+        return self.workers_finished.is_set()
+
+    def is_idle(self):
+        # True if the input queue was empty longer than empty_input_queue_timeout_sec
+        return self.work_done.is_set()
 
-    def stop(self):
-        self.shut_down.set()
-        self.worker_pool.close()
+    def end_of_stream(self):
+        # no more input: let the workers decode all enqueued data, then exit
+        if not self.running or self.stream_ended:
+            return
+        self.stream_ended = True
+        if self.backend == "inline":
+            self._flush_detector(self.detector)
+            self._finish()
+            return
+        for worker in self.workers:
+            self.input_queue.put(AthSpectralScanDecoder.end_of_stream_marker)
+        self.finisher = threading.Thread(target=self._join_workers, args=())
+        self.finisher.daemon = True
+        self.finisher.start()
+
+    def join(self, timeout=None):
+        # wait until all output is delivered. Returns False on timeout
+        return self.workers_finished.wait(timeout)
+
+    def stop(self, drain=True, timeout=5):
+        # drain=True: decode all data enqueued so far and wait up to timeout sec for it (a worker process can not exit
+        # before its output is consumed). drain=False: skip the enqueued data, worker processes which did not exit
+        # within timeout sec (e.g. blocked on an unread output queue) are terminated.
+        # Returns True if the decoder finished
+        if not self.running and not self.stream_ended:
+            return True
+        workers = list(self.workers)
+        if not drain:
+            self.shut_down.set()
+        self.end_of_stream()
+        finished = self.join(timeout)
+        if not finished and not drain and self.backend == "process":
+            # last resort: a process terminated while it writes to a queue may corrupt the queue
+            logger.warn("decoder processes did not exit within %s sec, terminate them" % timeout)
+            self.terminated = True
+            self.input_queue.cancel_join_thread()  # do not wait for the skipped input on exit
+            for worker in workers:
+                worker.terminate()
+            finished = self.join(timeout)
+        if not finished:
+            logger.warn("decoder did not finish within %s sec. Is the output queue read?" % timeout)
+        return finished
+
+    def _join_workers(self):
+        for worker in self.workers:
+            worker.join()
+            if self.backend == "process" and worker.exitcode and not self.terminated:
+                logger.error("decoder process %d exited with code %d" % (worker.pid, worker.exitcode))
+        self._finish()
+
+    def _finish(self):
+        # all workers are done (and their output is flushed): signal the end of the stream
+        if self.output_end_marker and self.output_queue is not None:
+            self.output_queue.put(AthSpectralScanDecoder.end_of_stream_marker)
+        if self.inline_session is not None:
+            self.inline_session.stop()
+            self.inline_session = None
+        self.workers = []
+        self.running = False
+        self.workers_finished.set()
 
     def set_output_queue(self, output_queue):
         #if not isinstance(output_queue, mp.Queue):
@@ -96,25 +267,137 @@ class AthSpectralScanDecoder(object):
         self.output_queue = output_queue
 
     def enqueue(self, data):
+        if self.backend == "inline" and self.running:
+            if self.profiler is not None and self.inline_session is None:
+                self.inline_session = self.profiler.session("decoder")  # e.g. the reader thread of DataHub
+            self._process_data(data, self.detector,
+                               self.inline_session.timers if self.inline_session is not None else None,
+                               self.load_controller)
+            return
         self.input_queue.put(data)
 
-    def _decode_data_process(self):
-        while not self.shut_down.is_set():
+    def _decode_data_process(self, detector=None, load_controller=None):
+        if self.backend == "process":
+            detector = self.detector
+            load_controller = self.load_controller
+        session = self.profiler.session("decoder") if self.profiler is not None else None
+        timers = session.timers if session is not None else None
+        while True:
+            if timers is not None:
+                t_start = perf_counter()
             try:
                 data = self.input_queue.get(timeout=self.input_queue_timeout)
                 self.work_done.clear()
             except Empty:
                 self.work_done.set()
                 continue
-            # process data
-            for decoded_sample in AthSpectralScanDecoder._decode(data, no_pwr=self.disable_pwr_decode):
+            finally:
+                if timers is not None:
+                    timers.add("worker;queue.get", perf_counter() - t_start)
+            if data is AthSpectralScanDecoder.end_of_stream_marker:
+                break
+            if self.shut_down.is_set():
+                continue  # stop without draining: skip the data until the stop marker
+            self._process_data(data, detector, timers, load_controller)
+        self._flush_detector(detector)
+        if session is not None:
+            session.stop()
+
+    def _process_data(self, data, detector, timers=None, load_controller=None):
+        try:
+            self._process_chunk(data, detector, timers, load_controller)
+        except Exception as e:
+            # e.g. an ath10k packet or an unknown chantype: skip the rest of the chunk, keep the worker alive
+            logger.warn("skip the rest of the chunk, can not decode it: %s" % e)
+
+    def _process_chunk(self, data, detector, timers, load_controller):
+        event_queue = self.event_queue if self.event_queue is not None else self.output_queue
+        # alarm-only setups (detector + event queue) may have no output queue
+        forward = self.forward_samples and self.output_queue is not None
+        if load_controller is not None:
+            self._process_data_controlled(data, detector, event_queue, load_controller, forward)
+            return
+        if timers is not None:
+            self._process_data_profiled(data, detector, event_queue, timers, forward)
+            return
+        for decoded_sample in AthSpectralScanDecoder._decode(data, no_pwr=self.disable_pwr_decode,
+                                                             projection=self.projection):
+            if forward:
                 self.output_queue.put(decoded_sample)
+            if detector is not None:
+                for event in detector.process(decoded_sample):
+                    event_queue.put(event)
+
+    def _process_data_controlled(self, data, detector, event_queue, load_controller, forward):
+        # same as _process_data(), with the fidelity of the load controller, tag the samples with it
+        fidelity = load_controller.update(self._input_queue_depth(), data[0])
+        if self.disable_pwr_decode:
+            fidelity = "metadata"
+        for decoded_sample in AthSpectralScanDecoder._decode(data, no_pwr=self.disable_pwr_decode, fidelity=fidelity,
+                                                             decimation=load_controller.decimation):
+            decoded_sample = decoded_sample + (fidelity,)
+            if forward:
+                self.output_queue.put(decoded_sample)
+            if detector is not None:
+                for event in detector.process(decoded_sample):
+                    event_queue.put(event)
+
+    def _input_queue_depth(self):
+        if self.backend == "inline":
+            return 0  # there is no queue, the data is decoded right away
+        try:
+            return self.input_queue.qsize()
+        except NotImplementedError:  # multiprocessing.Queue on macOS
+            return 0
+
+    def _process_data_profiled(self, data, detector, event_queue, timers, forward):
+        # same as _process_data(), with timers. The pickling is done by the queue in background, so estimate it
+        pickle_sample_rate = self.profiler.pickle_sample_rate
+        n = 0
+        (pickled, pickle_time) = (0, 0.0)
+        for decoded_sample in AthSpectralScanDecoder._decode(data, no_pwr=self.disable_pwr_decode,
+                                                             projection=self.projection, timers=timers):
+            if forward:
+                if n % pickle_sample_rate == 0:
+                    t_start = perf_counter()
+                    pickle.dumps(decoded_sample)
+                    pickle_time += perf_counter() - t_start
+                    pickled += 1
+                n += 1
+                t_start = perf_counter()
+                self.output_queue.put(decoded_sample)
+                timers.add("worker;queue.put", perf_counter() - t_start)
+            if detector is not None:
+                t_start = perf_counter()
+                for event in detector.process(decoded_sample):
+                    event_queue.put(event)
+                timers.add("worker;detector", perf_counter() - t_start)
+        if pickled:
+            timers.add("worker;pickle (estimated)", pickle_time / pickled * n, n)
+
+    def _flush_detector(self, detector):
+        if detector is None:
+            return
+        event_queue = self.event_queue if self.event_queue is not None else self.output_queue
+        for event in detector.flush():  # close open events on shut down
+            event_queue.put(event)
 
     @staticmethod
-    def _decode(data, no_pwr=False):
+    def _decode(data, no_pwr=False, projection=None, timers=None, fidelity=None, decimation=4):
+        # timers: optional StageTimers (see Profiler), to measure the stages unpack, pwr (log10) and dict
+        # fidelity: None / "full", "decimated" (groups of decimation bins), "peak" or "metadata", see LoadController
+        if projection is not None:
+            yield from AthSpectralScanDecoder._decode_projected(data, projection, no_pwr, timers)
+            return
+        if fidelity == "full":
+            fidelity = None
+        elif fidelity == "metadata":
+            no_pwr = True
         pos = 0
         (ts, data) = data
         while pos < len(data) - AthSpectralScanDecoder.hdrsize + 1:
+            if timers is not None:
+                t_start = perf_counter()
 
             (stype, slen) = struct.unpack_from(">BH", data, pos)
             if not ((stype == 1 and slen == AthSpectralScanDecoder.type1_pktsize) or
@@ -139,28 +422,31 @@ class AthSpectralScanDecoder(object):
 
                 sdata = struct.unpack_from("56B", data, pos)
                 pos += 56
+                if timers is not None:
+                    t_unpacked = perf_counter()
+                    timers.add("decode;unpack", t_unpacked - t_start)
 
                 # calculate power in dBm
-                sumsq_sample = 0
-                samples = []
-                for raw_sample in sdata:
-                    sample = (raw_sample << max_exp)**2
-                    sumsq_sample += sample
-                    samples.append(sample)
-
-                if sumsq_sample == 0:
+                (samples, mean) = AthSpectralScanDecoder._samples(sdata, max_exp)
+                sumsq_sample = AthSpectralScanDecoder._sumsq(samples)
+                if sumsq_sample is None:
                     continue  # drop invalid sample (all sub-carriers are zero)
-                sumsq_sample = 10 * math.log10(sumsq_sample)
+
+                if fidelity is not None:
+                    pwr = OrderedDict(AthSpectralScanDecoder._reduced_pwr(
+                        samples, AthSpectralScanDecoder._subcarriers(freq - 8.75, 56), 0, 56,
+                        noise + rssi, sumsq_sample, mean, fidelity, decimation))
+                    yield (ts, (tsf, freq, noise, rssi, pwr))
+                    continue
+                sigvals = AthSpectralScanDecoder._sigvals(samples, range(0, 56), noise + rssi, sumsq_sample, mean)
+                if timers is not None:
+                    t_pwr = perf_counter()
+                    timers.add("decode;pwr", t_pwr - t_unpacked)
 
                 # center freq / DC index is at bin 56/2=28 -> subcarrier_0 = freq - 28 * 0.3125 = freq - 8.75
-                subcarrier_0 = freq - 8.75
-                pwr = OrderedDict()
-                for i, sample in enumerate(samples):
-                    if sample == 0:                                         # this would break log()
-                        sample = sum(samples) / len(samples)                # anyone a better idea?
-                    subcarrier_i = subcarrier_0 + i * 0.3125
-                    sigval = noise + rssi + 10 * math.log10(sample) - sumsq_sample
-                    pwr[subcarrier_i] = sigval
+                pwr = OrderedDict(zip(AthSpectralScanDecoder._subcarriers(freq - 8.75, 56), sigvals))
+                if timers is not None:
+                    timers.add("decode;dict", perf_counter() - t_pwr)
                 # FIXME: add sigval for channel Sum(subcarriers):
                 # use log(x) + log(y) =  log(x*y) -> Sum(log(i)) = log(P(i)) with P as product
 
@@ -174,7 +460,7 @@ class AthSpectralScanDecoder(object):
                 (chantype, freq, rssi_l, rssi_u, tsf, noise_l, noise_u,
                  max_mag_l, max_mag_u, max_index_l, max_index_u,
                  hweight_l, hweight_u, max_exp) = \
-                    struct.unpack_from(">BHbbQbbHHbbbbb", data, pos)
+                    struct.unpack_from(">BHbbQbbHHbbbbB", data, pos)
                 pos += 24
 
                 if no_pwr:
@@ -184,27 +470,18 @@ class AthSpectralScanDecoder(object):
 
                 sdata = struct.unpack_from("128B", data, pos)
                 pos += 128
+                if timers is not None:
+                    t_unpacked = perf_counter()
+                    timers.add("decode;unpack", t_unpacked - t_start)
 
                 # calculate power in dBm
-                samples = []
-                for raw_sample in sdata:
-                    sample = (raw_sample << max_exp)**2
-                    samples.append(sample)
+                (samples, mean) = AthSpectralScanDecoder._samples(sdata, max_exp)
 
                 # create lower + upper binsum:
-                sumsq_sample_lower = 0
-                for sl in samples[0:63]:
-                    sumsq_sample_lower += sl
-                if sumsq_sample_lower == 0:
+                sumsq_sample_lower = AthSpectralScanDecoder._sumsq(samples[0:63])
+                sumsq_sample_upper = AthSpectralScanDecoder._sumsq(samples[64:127])
+                if sumsq_sample_lower is None or sumsq_sample_upper is None:
                     continue  # drop invalid sample (all sub-carriers are zero)
-                sumsq_sample_lower = 10 * math.log10(sumsq_sample_lower)
-
-                sumsq_sample_upper = 0
-                for su in samples[64:127]:
-                    sumsq_sample_upper += su
-                if sumsq_sample_upper == 0:
-                    continue  # drop invalid sample (all sub-carriers are zero)
-                sumsq_sample_upper = 10 * math.log10(sumsq_sample_upper)
 
                 # adjust center freq, depending on HT40+ or -
                 if chantype == 2:  # NL80211_CHAN_HT40MINUS
@@ -214,21 +491,181 @@ class AthSpectralScanDecoder(object):
                 else:
                     raise Exception("got unknown chantype: %d" % chantype)
 
-                # center freq / DC index is at bin 128/2=64 -> subcarrier_0 = freq - 64 * 0.3125 = freq - 20
-                subcarrier_0 = freq - 20
-                pwr = OrderedDict()
-                for i, sample in enumerate(samples):
-                    if sample == 0:                                         # this would break log()
-                        sample = sum(samples) / len(samples)                # anyone a better idea?
-                    if i < 64:
-                        sigval = noise_l + rssi_l + 10 * math.log10(sample) - sumsq_sample_lower
+                if fidelity is not None:
+                    subcarriers = AthSpectralScanDecoder._subcarriers(freq - 20, 128)
+                    lower = AthSpectralScanDecoder._reduced_pwr(samples, subcarriers, 0, 64,
+                                                                noise_l + rssi_l, sumsq_sample_lower, mean,
+                                                                fidelity, decimation)
+                    upper = AthSpectralScanDecoder._reduced_pwr(samples, subcarriers, 64, 128,
+                                                                noise_u + rssi_u, sumsq_sample_upper, mean,
+                                                                fidelity, decimation)
+                    if fidelity == "peak":  # the strongest bin of both halves
+                        pwr = OrderedDict(lower if lower[0][1] >= upper[0][1] else upper)
                     else:
-                        sigval = noise_u + rssi_u + 10 * math.log10(sample) - sumsq_sample_upper
-                    subcarrier_i = subcarrier_0 + i * 0.3125
-                    pwr[subcarrier_i] = sigval
+                        pwr = OrderedDict(lower + upper)
+                    yield (ts, (tsf, freq, (noise_l+noise_u)/2, (rssi_l+rssi_u)/2, pwr))
+                    continue
+                sigvals = AthSpectralScanDecoder._ht40_sigvals(samples, range(0, 128), noise_l + rssi_l,
+                                                               noise_u + rssi_u, sumsq_sample_lower,
+                                                               sumsq_sample_upper, mean)
+                if timers is not None:
+                    t_pwr = perf_counter()
+                    timers.add("decode;pwr", t_pwr - t_unpacked)
+
+                # center freq / DC index is at bin 128/2=64 -> subcarrier_0 = freq - 64 * 0.3125 = freq - 20
+                pwr = OrderedDict(zip(AthSpectralScanDecoder._subcarriers(freq - 20, 128), sigvals))
+                if timers is not None:
+                    timers.add("decode;dict", perf_counter() - t_pwr)
 
                 yield (ts, (tsf, freq, (noise_l+noise_u)/2, (rssi_l+rssi_u)/2, pwr))
 
             # ath10k
             elif stype == 3:
                 raise Exception("ath10k is not supported, sorry!")
+
+    @staticmethod
+    def _samples(sdata, max_exp):
+        # linear power of the bins and their mean, which replaces zero bins (0 would break log())
+        samples = [(raw_sample << max_exp)**2 for raw_sample in sdata]
+        return (samples, sum(samples) / len(samples))
+
+    @staticmethod
+    def _sumsq(samples):
+        # sum of the bins in dB, None if all sub-carriers are zero (invalid sample)
+        sumsq_sample = sum(samples)
+        if sumsq_sample == 0:
+            return None
+        return 10 * math.log10(sumsq_sample)
+
+    @staticmethod
+    def _sigvals(samples, bins, level, sumsq_sample, mean):
+        # dBm of the bins (indices). level: noise + rssi
+        return [level + 10 * math.log10(samples[i] if samples[i] else mean) - sumsq_sample for i in bins]
+
+    @staticmethod
+    def _ht40_sigvals(samples, bins, level_l, level_u, sumsq_sample_lower, sumsq_sample_upper, mean):
+        # dBm of the bins (a range), the lower and the upper half have their own noise, rssi and binsum
+        lower = range(bins.start, min(bins.stop, 64))
+        upper = range(max(bins.start, 64), bins.stop)
+        return AthSpectralScanDecoder._sigvals(samples, lower, level_l, sumsq_sample_lower, mean) + \
+            AthSpectralScanDecoder._sigvals(samples, upper, level_u, sumsq_sample_upper, mean)
+
+    @staticmethod
+    def _reduced_pwr(samples, subcarriers, start, stop, level, sumsq_sample, mean, fidelity, decimation):
+        # (freq, dBm) pairs of the bins start..stop for the reduced fidelities. level: noise + rssi
+        if fidelity == "peak":
+            peak = max(samples[start:stop])
+            i = samples.index(peak, start, stop)
+            return [(subcarriers[i], level + 10 * math.log10(peak if peak else mean) - sumsq_sample)]
+        pairs = []
+        for i in range(start, stop, decimation):
+            group = samples[i:min(i + decimation, stop)]
+            power = sum([sample if sample else mean for sample in group]) / len(group)  # zeros as in full decoding
+            pairs.append((subcarriers[i], level + 10 * math.log10(power) - sumsq_sample))
+        return pairs
+
+    @staticmethod
+    def _subcarriers(subcarrier_0, nbins):
+        # the sub-carrier frequencies of a channel, computed once
+        key = (subcarrier_0, nbins)
+        subcarriers = AthSpectralScanDecoder._subcarrier_cache.get(key)
+        if subcarriers is None:
+            subcarriers = tuple(subcarrier_0 + i * 0.3125 for i in range(nbins))
+            AthSpectralScanDecoder._subcarrier_cache[key] = subcarriers
+        return subcarriers
+
+    @staticmethod
+    def _decode_projected(data, projection, no_pwr=False, timers=None):
+        # same as _decode(), but emit only the fields of the projection and skip non-matching samples early
+        pos = 0
+        (ts, data) = data
+        fields = projection.fields
+        need_pwr = projection.need_pwr and not no_pwr
+        while pos < len(data) - AthSpectralScanDecoder.hdrsize + 1:
+            if timers is not None:
+                t_start = perf_counter()
+
+            (stype, slen) = struct.unpack_from(">BH", data, pos)
+            if not ((stype == 1 and slen == AthSpectralScanDecoder.type1_pktsize) or
+                    (stype == 2 and slen == AthSpectralScanDecoder.type2_pktsize) or
+                    (stype == 3 and slen == AthSpectralScanDecoder.type3_pktsize)):
+                logger.warn("skip malformed packet (type=%d, slen=%d) at pos=%d" % (stype, slen, pos))
+                break  # header malformed, discard data. This event is very unlikely (once in ~3h)
+            if stype == 3:
+                raise Exception("ath10k is not supported, sorry!")
+            if pos >= len(data) - AthSpectralScanDecoder.hdrsize - slen + 1:
+                break
+            pos += AthSpectralScanDecoder.hdrsize
+
+            # 20 MHz
+            if stype == 1:
+                (max_exp, freq, rssi, noise, max_mag, max_index, hweight, tsf) = \
+                    struct.unpack_from(">BHbbHBBQ", data, pos)
+                nbins = 56
+                bins_pos = pos + 17
+                pos += slen
+                if not projection.match(freq, noise, rssi):
+                    continue
+                values = {"tsf": tsf, "freq": freq, "noise": noise, "rssi": rssi, "max_exp": max_exp,
+                          "max_mag": max_mag, "max_index": max_index, "hweight": hweight}
+                subcarrier_0 = freq - 8.75
+
+            # 40 MHz
+            else:
+                (chantype, freq, rssi_l, rssi_u, tsf, noise_l, noise_u,
+                 max_mag_l, max_mag_u, max_index_l, max_index_u,
+                 hweight_l, hweight_u, max_exp) = \
+                    struct.unpack_from(">BHbbQbbHHbbbbB", data, pos)
+                nbins = 128
+                bins_pos = pos + 24
+                pos += slen
+                if no_pwr:
+                    center = freq  # as _decode(): without pwr values the freq is not shifted
+                elif chantype == 2:  # NL80211_CHAN_HT40MINUS
+                    center = freq - 10
+                elif chantype == 3:  # NL80211_CHAN_HT40PLUS
+                    center = freq + 10
+                else:
+                    raise Exception("got unknown chantype: %d" % chantype)
+                noise = (noise_l + noise_u) / 2
+                rssi = (rssi_l + rssi_u) / 2
+                if not projection.match(center, noise, rssi):
+                    continue
+                values = {"tsf": tsf, "freq": center, "noise": noise, "rssi": rssi, "max_exp": max_exp,
+                          "max_mag": (max_mag_l, max_mag_u), "max_index": (max_index_l, max_index_u),
+                          "hweight": (hweight_l, hweight_u)}
+                subcarrier_0 = center - 20
+
+            if not need_pwr:
+                values["pwr"] = dict()
+                yield (ts, tuple(values[field] for field in fields))
+                continue
+
+            sdata = struct.unpack_from("%dB" % nbins, data, bins_pos)
+            if timers is not None:
+                t_unpacked = perf_counter()
+                timers.add("decode;unpack", t_unpacked - t_start)
+            (samples, mean) = AthSpectralScanDecoder._samples(sdata, max_exp)
+            bins = projection.bin_range(nbins)
+            if stype == 1:
+                sumsq_sample = AthSpectralScanDecoder._sumsq(samples)
+                if sumsq_sample is None:
+                    continue  # drop invalid sample (all sub-carriers are zero)
+                sigvals = AthSpectralScanDecoder._sigvals(samples, bins, noise + rssi, sumsq_sample, mean)
+            else:
+                sumsq_sample_lower = AthSpectralScanDecoder._sumsq(samples[0:63])
+                sumsq_sample_upper = AthSpectralScanDecoder._sumsq(samples[64:127])
+                if sumsq_sample_lower is None or sumsq_sample_upper is None:
+                    continue  # drop invalid sample (all sub-carriers are zero)
+                sigvals = AthSpectralScanDecoder._ht40_sigvals(samples, bins, noise_l + rssi_l, noise_u + rssi_u,
+                                                               sumsq_sample_lower, sumsq_sample_upper, mean)
+            if timers is not None:
+                t_pwr = perf_counter()
+                timers.add("decode;pwr", t_pwr - t_unpacked)
+
+            subcarriers = AthSpectralScanDecoder._subcarriers(subcarrier_0, nbins)
+            values["pwr"] = OrderedDict(zip(subcarriers[bins.start:bins.stop], sigvals))
+            if timers is not None:
+                timers.add("decode;dict", perf_counter() - t_pwr)
+
+            yield (ts, tuple(values[field] for field in fields))
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+from array import array
+import logging
+logger = logging.getLogger(__name__)
+
+
+class BandSpectrum(object):
+
+    """ BandSpectrum stitches the decoded samples of all channels and HT modes into one spectrum of a whole band, e.g.
+    while sweeping the channels (chanscan). The band is a fixed grid of 0.3125 MHz (the ath9k FFT bin width) steps:
+
+    band - "2.4": 2400 - 2500 MHz, "5": 5150 - 5900 MHz or a (min MHz, max MHz) tuple. The grid starts at min, so
+           it should be a sub-carrier frequency (channel center + n * 0.3125 MHz), otherwise the bins are rounded
+    overlap - how bins of overlapping channels are combined: "max" (default), "mean" or "latest"
+
+    The grid indexes of a channel (first sub-carrier + number of bins) are calculated once, adding a sample costs one
+    look-up + one update per bin. Sub-carriers outside of the band are ignored. Grid points without data are NaN.
+    """
+
+    bin_width = 0.3125  # MHz
+    bands = {"2.4": (2400.125, 2500.125), "5": (5150.0, 5900.0)}  # aligned to the sub-carriers of channel 1 / 36
+    overlap_modes = ("max", "mean", "latest")
+
+    def __init__(self, band="2.4", overlap="max"):
+        if not isinstance(band, (tuple, list)):
+            if band not in BandSpectrum.bands:
+                raise Exception("unknown band '%s'. valid: %s" % (band, ", ".join(BandSpectrum.bands.keys())))
+            band = BandSpectrum.bands[band]
+        if band[1] <= band[0]:
+            raise Exception("invalid band: %s" % (band,))
+        if overlap not in BandSpectrum.overlap_modes:
+            raise Exception("unknown overlap mode '%s'. valid: %s" % (overlap, ", ".join(BandSpectrum.overlap_modes)))
+        self.overlap = overlap
+        self.start = band[0]
+        self.nbins = int(round((band[1] - band[0]) / BandSpectrum.bin_width)) + 1
+        self.values = array('d', [float("nan")] * self.nbins)
+        self.counts = array('I', bytes(4 * self.nbins))  # updates per grid point, the divisor in "mean" mode
+        self.index_maps = dict()  # (first subcarrier, number of bins) -> (grid indexes, positions of bins in the band)
+        self.sample_count = 0
+        self.ts = None  # time stamp of the last added sample
+
+    def add(self, sample):
+        (ts, (tsf, freq, noise, rssi, pwr)) = sample[0:2]
+        if not pwr:
+            return
+        key = (next(iter(pwr)), len(pwr))
+        index_map = self.index_maps.get(key)
+        if index_map is None:
+            index_map = self._index_map(pwr.keys())
+            self.index_maps[key] = index_map
+        (indexes, positions) = index_map
+        if positions is None:
+            values = pwr.values()  # the common case: all bins in the band
+        else:
+            all_values = list(pwr.values())
+            values = [all_values[p] for p in positions]
+        band_values = self.values
+        counts = self.counts
+        if self.overlap == "max":
+            for i, v in zip(indexes, values):
+                if not v <= band_values[i]:  # also true if there is no value yet (NaN)
+                    band_values[i] = v
+                counts[i] += 1
+        elif self.overlap == "latest":
+            for i, v in zip(indexes, values):
+                band_values[i] = v
+                counts[i] += 1
+        else:  # mean: sum up, divide in get_spectrum()
+            for i, v in zip(indexes, values):
+                if counts[i]:
+                    band_values[i] += v
+                else:
+                    band_values[i] = v
+                counts[i] += 1
+        self.sample_count += 1
+        self.ts = ts
+
+    def add_samples(self, samples):
+        for sample in samples:
+            self.add(sample)
+
+    def get_frequencies(self):
+        return [self.start + i * BandSpectrum.bin_width for i in range(self.nbins)]
+
+    def get_spectrum(self):
+        # list of dBm values, one per grid point (see get_frequencies()). NaN: no data
+        if self.overlap != "mean":
+            return self.values.tolist()
+        return [v / c if c else v for v, c in zip(self.values, self.counts)]
+
+    def get_counts(self):
+        # number of sample bins per grid point, e.g. to see the coverage of a sweep
+        return self.counts.tolist()
+
+    def reset(self):
+        # start a new sweep, the index maps are kept
+        for i in range(self.nbins):
+            self.values[i] = float("nan")
+            self.counts[i] = 0
+        self.sample_count = 0
+        self.ts = None
+
+    def _index_map(self, frequencies):
+        frequencies = list(frequencies)
+        indexes = []
+        positions = []
+        for p, f in enumerate(frequencies):
+            i = int(round((f - self.start) / BandSpectrum.bin_width))
+            if 0 <= i < self.nbins:
+                indexes.append(i)
+                positions.append(p)
+        if len(positions) == len(frequencies):
+            positions = None
+        elif not positions:
+            logger.debug("sub-carriers %.2f - %.2f MHz are outside of the band" % (frequencies[0], frequencies[-1]))
+        return (indexes, positions)
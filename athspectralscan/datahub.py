@@ -20,18 +20,105 @@
 ## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
 ##
 
+import os
 import threading
 import time
 import datetime
 import json
 import struct
+from time import perf_counter
+
+record_header = struct.Struct("<QI")  # <ts (int, ns resolution)><length>
+
+
+class DumpFileSink(object):
+
+    """ DumpFileSink writes chunks of raw spectral data to a dump file: <ts><len><samples><ts><len><samples>...
+    The record header and the data are not copied into one buffer, they are collected (as references) and written
+    with one vectored write (os.writev) per buffer_size bytes.
+
+    fsync_policy - "none": leave it to the OS (default), "chunk": flush + fsync after each chunk,
+                   "interval": flush + fsync at least every fsync_interval_sec
+    """
+
+    fsync_policies = ("none", "chunk", "interval")
+
+    def __init__(self, filename, fsync_policy="none", fsync_interval_sec=1.0, buffer_size=256*1024):
+        if fsync_policy not in DumpFileSink.fsync_policies:
+            raise Exception("unknown fsync policy '%s'. valid: %s" % (fsync_policy, ", ".join(DumpFileSink.fsync_policies)))
+        try:
+            self.fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        except FileNotFoundError:
+            raise Exception("Can not write output file '%s'!" % filename)
+        self.filename = filename
+        self.fsync_policy = fsync_policy
+        self.fsync_interval_sec = fsync_interval_sec
+        self.buffer_size = buffer_size
+        try:
+            self.max_iov = os.sysconf("SC_IOV_MAX")
+        except (ValueError, OSError, AttributeError):
+            self.max_iov = 1024
+        self.buffers = []
+        self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def write_chunk(self, ts, data, header=None):
+        if header is None:
+            header = DataHub.pack_record_header(ts, len(data))
+        self.buffers.append(header)
+        self.buffers.append(data)
+        self.pending += len(header) + len(data)
+        if self.fsync_policy == "chunk":
+            self.sync()
+        elif self.fsync_policy == "interval" and time.monotonic() - self.last_sync >= self.fsync_interval_sec:
+            self.sync()
+        elif self.pending >= self.buffer_size or len(self.buffers) >= self.max_iov:
+            self.flush()
+
+    def flush(self):
+        buffers = self.buffers
+        while buffers:
+            written = os.writev(self.fd, buffers[:self.max_iov])
+            # drop the written buffers, keep the rest of a partially written one
+            n = 0
+            while n < len(buffers) and written >= len(buffers[n]):
+                written -= len(buffers[n])
+                n += 1
+            buffers = buffers[n:]
+            if written:
+                buffers[0] = memoryview(buffers[0])[written:]
+        self.buffers = []
+        self.pending = 0
+
+    def sync(self):
+        self.flush()
+        os.fsync(self.fd)
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.fd is None:
+            return
+        if self.fsync_policy == "none":
+            self.flush()
+        else:
+            self.sync()
+        os.close(self.fd)
+        self.fd = None
 
 
 class DataHub(object):
 
+    """ DataHub reads raw spectral data from spectral_scan0 (via an AthSpectralScanner) or a recorded dump file and
+    passes each chunk to the decoder and any number of sinks. A sink is an object with a method
+    write_chunk(ts, data, header), e.g. DumpFileSink or SpectrumServer. The chunk is not copied, all sinks and the
+    decoder share the same bytes object. The record header (see record_header) is packed once per chunk.
+    """
+
     ts_format_string = "%Y-%m-%d %H:%M:%S"
+    chunk_size = 16*1024*1024  # read size for recorded data
 
-    def __init__(self, scanner=None, dump_file_in=None, dump_file_out=None, decoder=None):
+    def __init__(self, scanner=None, dump_file_in=None, dump_file_out=None, decoder=None, sinks=None,
+                 fsync_policy="none"):
         # Config ok: {S_xx, _Ixx} (1 input) Output is always xx (don't care)
         # Config invalid: {SIxx} (2 inputs), {__xx} (0 inputs)
         if (scanner is not None and dump_file_in is not None) or (scanner is None and dump_file_in is None):
@@ -46,12 +133,11 @@ class DataHub(object):
         except FileNotFoundError:
             raise Exception("Can not read input file '%s'!" % dump_file_in)
 
-        self.dump_file_out_handle = None
+        self.sinks = list(sinks) if sinks is not None else []
+        self.dump_file_sink = None
         if dump_file_out is not None:
-            try:
-                self.dump_file_out_handle = open(dump_file_out, "wb")
-            except FileNotFoundError:
-                raise Exception("Can not write output file '%s'!" % dump_file_out)
+            self.dump_file_sink = DumpFileSink(dump_file_out, fsync_policy=fsync_policy)
+            self.sinks.append(self.dump_file_sink)
             self.filename_meta_data = dump_file_out + ".json"
         else:
             self.filename_meta_data = None
@@ -61,6 +147,22 @@ class DataHub(object):
         self.start_time = None
         self.dump_meta_info = None
         self.decoder = decoder
+        self.profiler = None
+
+    @staticmethod
+    def pack_record_header(ts, length):
+        if isinstance(ts, datetime.datetime):
+            ts = ts.timestamp()
+        return record_header.pack(int(ts * 1e9), length)  # int, ns resolution
+
+    def set_profiler(self, profiler):
+        # a Profiler: take per-stage timers (and optional cProfile data) in the reader thread
+        self.profiler = profiler
+
+    def add_sink(self, sink):
+        if self.reader_thread is not None:
+            raise Exception("can not add a sink to a running DataHub!")
+        self.sinks.append(sink)
 
     def start(self):
         if self.reader_thread is not None:
@@ -89,52 +191,86 @@ class DataHub(object):
         self.reader_thread.join()
         self.reader_thread = None
         self.dump_file_in_handle.close()
-        if self.dump_file_out_handle is not None:
-            self.dump_file_out_handle.close()
+        if self.dump_file_sink is not None:
+            self.dump_file_sink.close()
 
     def _distribute_data(self):
-        chunk_size = 1024*1024*1024
-        while not self.stop_reader_thread.is_set():
-            if self.read_recorded_data:
-                # read <ts><len><samples><ts><len><samples> until the file ends, then exit thread
-                data = bytes()
-                file_pos = 0
-                while True:
-                    self.dump_file_in_handle.seek(file_pos)
-                    data += self.dump_file_in_handle.read(chunk_size)
-                    file_pos += chunk_size
-                    if len(data) is 0:  # hit EOF
-                        self.stop_reader_thread.set()  # EOF -> quit
-                    # if output is a file, no need to unpack something
-                    if self.dump_file_out_handle is not None:
-                        self.dump_file_out_handle.write(data)
-                    # if output is a decoder, we need to unpack it
-                    if self.decoder is not None:
-                        while len(data) > 12:
-                            (ts,) = struct.unpack_from('<Q', data[0:8])
-                            ts = ts / 1e9  # was stored as int. convert back to float, ns resolution
-                            (length, ) = struct.unpack_from('<I', data[8:12])
-                            if length > len(data[12:]):
+        sinks = self.sinks
+        decoder = self.decoder
+        session = self.profiler.session("hub") if self.profiler is not None else None
+        timers = session.timers if session is not None else None
+        try:
+            while not self.stop_reader_thread.is_set():
+                if self.read_recorded_data:
+                    # read <ts><len><samples><ts><len><samples> until the file ends, then exit thread
+                    data = bytes()
+                    while not self.stop_reader_thread.is_set():
+                        if timers is not None:
+                            t_start = perf_counter()
+                        block = self.dump_file_in_handle.read(DataHub.chunk_size)
+                        if timers is not None:
+                            timers.add("read", perf_counter() - t_start)
+                        if not block:  # hit EOF (an incomplete record at the end is dropped)
+                            self.stop_reader_thread.set()  # EOF -> quit
+                            break
+                        data = data + block if data else block
+                        pos = 0
+                        while pos + record_header.size <= len(data):
+                            (ts, length) = record_header.unpack_from(data, pos)
+                            end = pos + record_header.size + length
+                            if end > len(data):
                                 break  # need more data
-                            data = data[12:]
-                            sample = data[0:length]
-                            data = data[length:]
-                            self.decoder.enqueue((ts, sample))
-                    if self.stop_reader_thread.is_set():
-                        break
-            # read live data -> already chunk'ed
-            else:
-                ts = datetime.datetime.now()
-                data = self.dump_file_in_handle.read()
-                if not data:
-                    time.sleep(0.1)
-                    continue
+                            ts = ts / 1e9  # was stored as int. convert back to float, ns resolution
+                            sample = data[pos + record_header.size:end]
+                            if timers is not None:
+                                self._distribute_profiled(timers, ts, sample, data[pos:pos + record_header.size])
+                                pos = end
+                                continue
+                            if sinks:
+                                header = data[pos:pos + record_header.size]  # keep the original header, no re-encoding
+                                for sink in sinks:
+                                    sink.write_chunk(ts, sample, header)
+                            if decoder is not None:
+                                decoder.enqueue((ts, sample))
+                            pos = end
+                        data = data[pos:]
+                # read live data -> already chunk'ed
                 else:
-                    # if output is file, pack <ts><len><samples>
-                    if self.dump_file_out_handle:
-                        self.dump_file_out_handle.write(struct.pack("<Q", int(ts.timestamp() * 1e9)))  # int, ns resolution
-                        self.dump_file_out_handle.write(struct.pack("<I", len(data)))
-                        self.dump_file_out_handle.write(data)
-                    # if output is decoder, append ts and pass it queue
-                    if self.decoder:
-                        self.decoder.enqueue((ts, data))
+                    ts = datetime.datetime.now()
+                    if timers is not None:
+                        t_start = perf_counter()
+                    data = self.dump_file_in_handle.read()
+                    if timers is not None:
+                        timers.add("read", perf_counter() - t_start)
+                    if not data:
+                        time.sleep(0.1)
+                        continue
+                    elif timers is not None:
+                        self._distribute_profiled(timers, ts, data, DataHub.pack_record_header(ts, len(data)))
+                    else:
+                        # sinks (e.g. file): pack <ts><len> once, share it (and the data) with all sinks
+                        if sinks:
+                            header = DataHub.pack_record_header(ts, len(data))
+                            for sink in sinks:
+                                sink.write_chunk(ts, data, header)
+                        # if output is decoder, append ts and pass it queue
+                        if decoder:
+                            decoder.enqueue((ts, data))
+        finally:
+            # no more data (EOF or stopped): let the decoder finish its work and signal the end of the stream
+            if self.decoder is not None:
+                self.decoder.end_of_stream()
+            if session is not None:
+                session.stop()
+
+    def _distribute_profiled(self, timers, ts, data, header):
+        # same as the distribution in _distribute_data(), with timers
+        if self.sinks:
+            t_start = perf_counter()
+            for sink in self.sinks:
+                sink.write_chunk(ts, data, header)
+            timers.add("sinks", perf_counter() - t_start)
+        if self.decoder is not None:
+            t_start = perf_counter()
+            self.decoder.enqueue((ts, data))
+            timers.add("enqueue", perf_counter() - t_start)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+from array import array
+from collections import OrderedDict
+from .athspectralscandecoder import AthSpectralScanDecoder
+from .dumpindex import DumpIndex
+import logging
+logger = logging.getLogger(__name__)
+
+
+class CachedSpectra(object):
+
+    """ Decoded samples of a dump file, memory-mapped from a DecodeCache entry. The values are available as arrays
+    (memoryviews), one entry per sample: ts, tsf, freq, noise2, rssi2 (2x noise / rssi), ht40, nbins and pwr, a float32 matrix with a row of
+    CachedSpectra.stride values per sample (the first nbins values of a row are valid). Iterating yields the samples
+    in the regular decoder format (ts, (tsf, freq, noise, rssi, pwr)), with float32 precision of pwr.
+    """
+
+    magic = b"ASC2"
+    header_format = "<4sIIII4x"  # magic, decoder version, no_pwr, number of samples, stride
+    stride = 128  # max. number of bins (HT40)
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.decoder_version, no_pwr, count, stride) = \
+            struct.unpack_from(CachedSpectra.header_format, self.mmap)
+        if magic != CachedSpectra.magic:
+            self.mmap.close()
+            raise Exception("'%s' is not a decode cache file!" % filename)
+        self.no_pwr = bool(no_pwr)
+        self.count = count
+        self.stride = stride
+        pos = struct.calcsize(CachedSpectra.header_format)
+        (self.ts, pos) = self._view(pos, count, 'd')
+        (self.tsf, pos) = self._view(pos, count, 'Q')
+        (self.freq, pos) = self._view(pos, count, 'i')
+        (self.noise2, pos) = self._view(pos, count, 'h')  # 2x noise / rssi: HT40 values are averages of 2 ints
+        (self.rssi2, pos) = self._view(pos, count, 'h')
+        (self.ht40, pos) = self._view(pos, count, 'B')  # noise + rssi of HT40 samples are floats (averages)
+        pos += -pos % 2
+        (self.nbins, pos) = self._view(pos, count, 'H')
+        pos += -pos % 4
+        (self.pwr, pos) = self._view(pos, count * stride, 'f')
+
+    def _view(self, pos, count, typecode):
+        size = array(typecode).itemsize * count
+        if sys.byteorder == "little":
+            view = memoryview(self.mmap)[pos:pos + size].cast(typecode)
+        else:
+            view = array(typecode)
+            view.frombytes(self.mmap[pos:pos + size])
+            view.byteswap()
+        return (view, pos + size)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.sample(i)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def row(self, i):
+        return self.pwr[i * self.stride:i * self.stride + self.nbins[i]]
+
+    def sample(self, i):
+        nbins = self.nbins[i]
+        freq = self.freq[i]
+        if self.ht40[i]:
+            (noise, rssi) = (self.noise2[i] / 2, self.rssi2[i] / 2)
+        else:
+            (noise, rssi) = (self.noise2[i] // 2, self.rssi2[i] // 2)
+        pwr = OrderedDict()
+        if not self.no_pwr:
+            subcarrier_0 = freq - nbins / 2 * 0.3125
+            for n, v in enumerate(self.row(i)):
+                pwr[subcarrier_0 + n * 0.3125] = v
+        return (self.ts[i], (self.tsf[i], freq, noise, rssi, pwr))
+
+    def close(self):
+        for name in ("ts", "tsf", "freq", "noise2", "rssi2", "ht40", "nbins", "pwr"):
+            view = getattr(self, name, None)
+            if isinstance(view, memoryview):
+                view.release()
+        self.mmap.close()
+
+    @staticmethod
+    def write(filename, samples, no_pwr):
+        ts = array('d')
+        tsf = array('Q')
+        freq = array('i')
+        noise2 = array('h')
+        rssi2 = array('h')
+        ht40 = array('B')
+        nbins = array('H')
+        pwr = array('f')
+        stride = 0 if no_pwr else CachedSpectra.stride
+        padding = [float("nan")] * stride
+        for (t, (s_tsf, s_freq, s_noise, s_rssi, s_pwr)) in samples:
+            ts.append(t)
+            tsf.append(s_tsf)
+            freq.append(int(s_freq))
+            noise2.append(int(s_noise * 2))
+            rssi2.append(int(s_rssi * 2))
+            ht40.append(isinstance(s_noise, float))  # HT20: ints, HT40: averages of the lower + upper half
+            nbins.append(len(s_pwr) if not no_pwr else 0)
+            if not no_pwr:
+                pwr.extend(s_pwr.values())
+                pwr.extend(padding[len(s_pwr):])
+        with open(filename, "wb") as f:
+            f.write(struct.pack(CachedSpectra.header_format, CachedSpectra.magic,
+                                AthSpectralScanDecoder.decoder_version, int(no_pwr), len(ts), stride))
+            pos = struct.calcsize(CachedSpectra.header_format)
+            for a in (ts, tsf, freq, noise2, rssi2, ht40, nbins, pwr):
+                if a is nbins or a is pwr:
+                    alignment = a.itemsize
+                    f.write(bytes(-pos % alignment))  # align the uint16 array / the float32 matrix
+                    pos += -pos % alignment
+                if sys.byteorder != "little":
+                    a.byteswap()
+                f.write(a.tobytes())
+                pos += a.itemsize * len(a)
+
+
+class DecodeCache(object):
+
+    """ DecodeCache stores the decoded samples of dump files on disk, so replays of the same dump after the first one
+    only need to map the cache file instead of decoding it again.
+
+    The entries are keyed by the SHA-1 of the dump content, the decoder version and options (no_pwr). Entries of other
+    decoder versions are removed. If the cache grows beyond max_bytes, the least recently used entries are removed.
+    The hashes of the dump files are remembered (by path, size and mtime), so a hit does not need to re-read the dump.
+    """
+
+    suffix = ".cache"
+    hashes_filename = "hashes.json"
+
+    def __init__(self, cache_dir, max_bytes=4*1024*1024*1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.hashes_file = os.path.join(cache_dir, DecodeCache.hashes_filename)
+        try:
+            with open(self.hashes_file) as f:
+                self.hashes = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.hashes = dict()
+        self._remove_outdated()
+
+    def decode(self, dump_file, no_pwr=False):
+        filename = self._entry(dump_file, no_pwr)
+        if os.path.exists(filename):
+            try:
+                spectra = CachedSpectra(filename)
+                os.utime(filename)  # mark as recently used
+                logger.debug("decode cache hit for '%s'" % dump_file)
+                return spectra
+            except Exception as e:  # e.g. an entry of an older cache file format
+                logger.debug("invalid decode cache entry '%s' (%s), decoding again" % (filename, e))
+                os.remove(filename)
+        logger.debug("decode cache miss for '%s', decoding" % dump_file)
+        tmp_filename = filename + ".%d.tmp" % os.getpid()
+        CachedSpectra.write(tmp_filename, DecodeCache._decode_file(dump_file, no_pwr), no_pwr)
+        os.replace(tmp_filename, filename)
+        self._evict(keep=filename)
+        return CachedSpectra(filename)
+
+    def clear(self):
+        for filename in self._entries():
+            os.remove(filename)
+
+    def size(self):
+        return sum(os.path.getsize(filename) for filename in self._entries())
+
+    @staticmethod
+    def _decode_file(dump_file, no_pwr):
+        index = DumpIndex(dump_file, use_index_file=False)  # do not write next to the dump of the user
+        with open(dump_file, "rb") as f:
+            for i in range(len(index)):
+                f.seek(index.offsets[i])
+                data = f.read(index.lengths[i])
+                yield from AthSpectralScanDecoder._decode((index.ts[i], data), no_pwr=no_pwr)
+
+    def _entry(self, dump_file, no_pwr):
+        return os.path.join(self.cache_dir, "%s-%d-%s%s" % (self._hash(dump_file),
+                                                            AthSpectralScanDecoder.decoder_version,
+                                                            "nopwr" if no_pwr else "pwr", DecodeCache.suffix))
+
+    def _hash(self, dump_file):
+        path = os.path.abspath(dump_file)
+        stat = os.stat(path)
+        known = self.hashes.get(path)
+        if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(1024*1024)
+                if not block:
+                    break
+                sha1.update(block)
+        self.hashes[path] = (stat.st_size, stat.st_mtime_ns, sha1.hexdigest())
+        with open(self.hashes_file, "w") as f:
+            json.dump(self.hashes, f)
+        return sha1.hexdigest()
+
+    def _entries(self):
+        return [os.path.join(self.cache_dir, fn) for fn in os.listdir(self.cache_dir) if fn.endswith(DecodeCache.suffix)]
+
+    def _remove_outdated(self):
+        for filename in self._entries():
+            if filename.split("-")[-2] != str(AthSpectralScanDecoder.decoder_version):
+                logger.debug("remove decode cache entry of other decoder version: '%s'" % filename)
+                os.remove(filename)
+
+    def _evict(self, keep):
+        entries = sorted(self._entries(), key=os.path.getmtime)
+        total = sum(os.path.getsize(filename) for filename in entries)
+        for filename in entries:
+            if total <= self.max_bytes:
+                break
+            if filename == keep:
+                continue
+            total -= os.path.getsize(filename)
+            logger.debug("evict decode cache entry '%s'" % filename)
+            os.remove(filename)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+
+class DecodeProjection(object):
+
+    """ DecodeProjection tells AthSpectralScanDecoder what to decode, so a job pays only for what it reads.
+
+    fields - the values to emit, in this order. Valid: tsf, freq, noise, rssi, max_exp, max_mag, max_index, hweight,
+             pwr. The decoded sample is (ts, (<fields>)), so the default equals the regular decoder output.
+             For HT40 samples max_mag, max_index and hweight are (lower, upper) tuples.
+    bins - (start, stop) range of the sub-carriers (FFT bins) to calculate pwr for. None: all bins
+    freq - only emit samples with this center frequency. An int or a (min, max) tuple. Like the regular decoder
+           output, the freq of HT40 samples is not shifted to the 40 MHz center if pwr decoding is disabled
+    rssi - only emit samples within this (min, max) rssi range. None as min or max: no limit
+    noise - only emit samples within this (min, max) noise range. None as min or max: no limit
+
+    The predicates (freq, rssi, noise) are checked right after the header is unpacked, the expensive log10() is only
+    done for the requested bins and only if pwr is a requested field.
+    A projection can not be combined with a detector or a load controller of AthSpectralScanDecoder.
+    """
+
+    valid_fields = ("tsf", "freq", "noise", "rssi", "max_exp", "max_mag", "max_index", "hweight", "pwr")
+
+    def __init__(self, fields=("tsf", "freq", "noise", "rssi", "pwr"), bins=None, freq=None, rssi=None, noise=None):
+        for field in fields:
+            if field not in DecodeProjection.valid_fields:
+                raise Exception("unknown field '%s'. valid: %s" % (field, ", ".join(DecodeProjection.valid_fields)))
+        self.fields = tuple(fields)
+        self.need_pwr = "pwr" in self.fields
+        if bins is not None and (bins[0] < 0 or bins[1] <= bins[0]):
+            raise Exception("invalid bin range: %s" % (bins,))
+        self.bins = bins
+        self.freq = DecodeProjection._range(freq)
+        self.rssi = DecodeProjection._range(rssi)
+        self.noise = DecodeProjection._range(noise)
+
+    @staticmethod
+    def _range(r):
+        if r is None:
+            return None
+        if not isinstance(r, (tuple, list)):
+            return (r, r)
+        return (-float("inf") if r[0] is None else r[0], float("inf") if r[1] is None else r[1])
+
+    def match(self, freq, noise, rssi):
+        if self.freq is not None and not self.freq[0] <= freq <= self.freq[1]:
+            return False
+        if self.rssi is not None and not self.rssi[0] <= rssi <= self.rssi[1]:
+            return False
+        if self.noise is not None and not self.noise[0] <= noise <= self.noise[1]:
+            return False
+        return True
+
+    def bin_range(self, nbins):
+        if self.bins is None:
+            return range(0, nbins)
+        return range(min(self.bins[0], nbins), min(self.bins[1], nbins))
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+import os
+import sys
+import bisect
+import struct
+import datetime
+from array import array
+import multiprocessing as mp
+from .athspectralscandecoder import AthSpectralScanDecoder
+import logging
+logger = logging.getLogger(__name__)
+
+
+class DumpIndex(object):
+
+    """ DumpIndex holds the block-level metadata of a dump file written by DataHub: for each record
+    (<ts><len><samples>) the time stamp, the file offset + length of the samples and the range of the channel
+    frequencies found in the sample headers. The index is built by reading only the headers (no decoding) and
+    stored next to the dump as <dump file>.idx. It is rebuilt if the dump file changes (size, mtime).
+    """
+
+    suffix = ".idx"
+    magic = b"ASI1"
+    header_format = "<4sQQQ"  # magic, dump size, dump mtime (ns), number of records
+    record_header_size = 12  # <Q ts><I length>
+    ht40_shift = 10  # MHz, the decoded center freq of HT40 samples is shifted by +-10 MHz
+
+    def __init__(self, dump_file, use_index_file=True):
+        self.dump_file = dump_file
+        self.index_file = dump_file + DumpIndex.suffix if use_index_file else None
+        stat = os.stat(dump_file)
+        self.dump_size = stat.st_size
+        self.dump_mtime = stat.st_mtime_ns
+        self.ts = array('d')
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.freq_min = array('H')
+        self.freq_max = array('H')
+        if self.index_file is None or not self._load():
+            self._build()
+            if self.index_file is not None:
+                self._save()
+
+    def __len__(self):
+        return len(self.ts)
+
+    def find(self, t0=None, t1=None, freq=None):
+        # return the record numbers with t0 <= ts <= t1 and a channel in the requested freq range
+        first = 0 if t0 is None else bisect.bisect_left(self.ts, t0)
+        last = len(self.ts) if t1 is None else bisect.bisect_right(self.ts, t1)
+        if freq is None:
+            return list(range(first, last))
+        (lo, hi) = _freq_range(freq)
+        lo -= DumpIndex.ht40_shift
+        hi += DumpIndex.ht40_shift
+        return [i for i in range(first, last) if self.freq_min[i] <= hi and self.freq_max[i] >= lo]
+
+    def _build(self):
+        hdrsize = AthSpectralScanDecoder.hdrsize
+        with open(self.dump_file, "rb") as f:
+            file_pos = 0
+            while True:
+                header = f.read(DumpIndex.record_header_size)
+                if len(header) < DumpIndex.record_header_size:
+                    break
+                (ts, length) = struct.unpack("<QI", header)
+                data = f.read(length)
+                if len(data) < length:
+                    break  # truncated record, e.g. recording was killed
+                # walk the sample headers: <B type><H len>, the freq is at offset 1 of both type 1 and type 2
+                freq_min = 0xffff
+                freq_max = 0
+                pos = 0
+                while pos + hdrsize + 3 <= length:
+                    (stype, slen, freq) = struct.unpack_from(">BHxH", data, pos)
+                    if stype not in (1, 2):
+                        break
+                    if freq < freq_min:
+                        freq_min = freq
+                    if freq > freq_max:
+                        freq_max = freq
+                    pos += hdrsize + slen
+                self.ts.append(ts / 1e9)
+                self.offsets.append(file_pos + DumpIndex.record_header_size)
+                self.lengths.append(length)
+                self.freq_min.append(freq_min)
+                self.freq_max.append(freq_max)
+                file_pos += DumpIndex.record_header_size + length
+        logger.debug("indexed %d records of '%s'" % (len(self.ts), self.dump_file))
+
+    def _arrays(self):
+        return (self.ts, self.offsets, self.lengths, self.freq_min, self.freq_max)
+
+    def _load(self):
+        try:
+            with open(self.index_file, "rb") as f:
+                data = f.read()
+        except (FileNotFoundError, PermissionError):
+            return False
+        size = struct.calcsize(DumpIndex.header_format)
+        if len(data) < size:
+            return False
+        (magic, dump_size, dump_mtime, count) = struct.unpack_from(DumpIndex.header_format, data)
+        if magic != DumpIndex.magic or dump_size != self.dump_size or dump_mtime != self.dump_mtime:
+            return False  # index is outdated
+        pos = size
+        for a in self._arrays():
+            nbytes = a.itemsize * count
+            a.frombytes(data[pos:pos + nbytes])
+            pos += nbytes
+            if sys.byteorder != "little":
+                a.byteswap()
+        return True
+
+    def _save(self):
+        try:
+            with open(self.index_file, "wb") as f:
+                f.write(struct.pack(DumpIndex.header_format, DumpIndex.magic, self.dump_size, self.dump_mtime,
+                                    len(self.ts)))
+                for a in self._arrays():
+                    if sys.byteorder != "little":
+                        a = array(a.typecode, a)
+                        a.byteswap()
+                    f.write(a.tobytes())
+        except OSError as e:
+            logger.warning("can not write index file '%s': %s" % (self.index_file, e))
+
+
+def _to_seconds(t):
+    if isinstance(t, datetime.datetime):
+        return t.timestamp()
+    return t
+
+
+def _freq_range(freq):
+    if isinstance(freq, (tuple, list)):
+        return (freq[0], freq[1])
+    return (freq, freq)
+
+
+def _decode_records(args):
+    (dump_file, records, freq, no_pwr) = args
+    if freq is not None:
+        (lo, hi) = _freq_range(freq)
+    result = []
+    with open(dump_file, "rb") as f:
+        for (ts, offset, length) in records:
+            f.seek(offset)
+            data = f.read(length)
+            for sample in AthSpectralScanDecoder._decode((ts, data), no_pwr=no_pwr):
+                if freq is None or lo <= sample[1][1] <= hi:
+                    result.append(sample)
+    return result
+
+
+def query(path, t0, t1, freq=None, no_pwr=False, processes=None, min_bytes_per_process=4*1024*1024):
+    """ Decode only the samples of a dump file recorded between t0 and t1 (seconds or datetime, None = open end).
+    freq is a channel center frequency or a (min, max) tuple. Records outside of the range are skipped via the
+    DumpIndex, without reading their samples. Large ranges are decoded by several processes (default: one per CPU),
+    the result is a list of samples in the order of the dump file.
+    """
+    index = DumpIndex(path)
+    t0 = _to_seconds(t0)
+    t1 = _to_seconds(t1)
+    records = [(index.ts[i], index.offsets[i], index.lengths[i]) for i in index.find(t0, t1, freq)]
+    total_bytes = sum(r[2] for r in records)
+    if processes is None:
+        processes = mp.cpu_count()
+    processes = min(processes, total_bytes // min_bytes_per_process, len(records))
+    if processes <= 1:
+        return _decode_records((path, records, freq, no_pwr))
+
+    # split the records into one batch per process, keep the order
+    batches = []
+    batch_bytes = total_bytes / processes
+    batch = []
+    size = 0
+    for record in records:
+        batch.append(record)
+        size += record[2]
+        if size >= batch_bytes:
+            batches.append((path, batch, freq, no_pwr))
+            batch = []
+            size = 0
+    if batch:
+        batches.append((path, batch, freq, no_pwr))
+    result = []
+    with mp.Pool(processes=processes) as pool:
+        for samples in pool.map(_decode_records, batches):
+            result.extend(samples)
+    return result
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class _ChannelState(object):
+
+    def __init__(self):
+        self.active = False
+        self.count_above = 0
+        self.count_below = 0
+        self.start_tsf = None
+        self.end_tsf = None
+        self.freq_lo = None
+        self.freq_hi = None
+        self.peak = None
+
+    def update(self, tsf, freq_lo, freq_hi, peak):
+        if self.start_tsf is None:
+            self.start_tsf = tsf
+            self.freq_lo = freq_lo
+            self.freq_hi = freq_hi
+            self.peak = peak
+        else:
+            self.freq_lo = min(self.freq_lo, freq_lo)
+            self.freq_hi = max(self.freq_hi, freq_hi)
+            self.peak = max(self.peak, peak)
+        self.end_tsf = tsf
+
+    def event(self):
+        return (self.start_tsf, self.end_tsf, self.freq_lo, self.freq_hi, self.peak)
+
+
+class InterferenceDetector(object):
+
+    """ InterferenceDetector flags sustained energy on a channel. The input are decoded samples, the output are compact
+    events (start_tsf, end_tsf, freq_lo, freq_hi, peak_dbm) instead of raw spectra.
+
+    The energy is taken from the rssi field, which ath9k reports relative to the noise floor (dB). An event starts if
+    rssi >= threshold_db for min_samples consecutive samples and ends if rssi < threshold_db - hysteresis_db for
+    hold_samples consecutive samples. If pwr values are decoded, the frequency span covers all sub-carriers above
+    noise + threshold_db and the peak is the strongest sub-carrier. Otherwise (no_pwr) the span is the channel and the
+    peak is noise + rssi. The channel width is taken from the noise field: HT40 samples carry the average of both
+    halves (float), HT20 samples an int. Please note, that the decoder does not shift the freq of HT40 samples to the
+    center of the 40 MHz channel if no pwr values are decoded, so their span is only approximate (+/- 10 MHz).
+
+    The detector can run inline in the workers of AthSpectralScanDecoder (see set_detector()). Please note, that each
+    worker process gets its own copy of the detector. With more than one process the samples of a channel are split
+    over the workers, so use a single process if the hysteresis needs to see every sample.
+    """
+
+    ht20_half_bandwidth = 8.75  # MHz, see AthSpectralScanDecoder: 56 bins * 0.3125 MHz / 2
+    ht40_half_bandwidth = 20.0  # MHz, 128 bins * 0.3125 MHz / 2
+
+    def __init__(self, threshold_db=10, hysteresis_db=3, min_samples=3, hold_samples=3):
+        if hysteresis_db < 0 or min_samples < 1 or hold_samples < 1:
+            raise Exception("invalid detector config: hysteresis_db >= 0, min_samples >= 1, hold_samples >= 1")
+        self.threshold_db = threshold_db
+        self.release_db = threshold_db - hysteresis_db
+        self.min_samples = min_samples
+        self.hold_samples = hold_samples
+        self.channels = dict()  # freq -> _ChannelState
+
+    def process(self, sample):
+        (ts, (tsf, freq, noise, rssi, pwr)) = sample[0:2]
+        state = self.channels.get(freq)
+        if state is None:
+            state = _ChannelState()
+            self.channels[freq] = state
+
+        if not state.active:
+            if rssi < self.threshold_db:
+                if state.count_above:
+                    self.channels[freq] = _ChannelState()  # energy was not sustained, forget it
+                return []
+            state.count_above += 1
+            state.update(tsf, *self._span_and_peak(freq, noise, rssi, pwr))
+            if state.count_above >= self.min_samples:
+                state.active = True
+            return []
+
+        if rssi >= self.release_db:
+            state.count_below = 0
+            state.update(tsf, *self._span_and_peak(freq, noise, rssi, pwr))
+            return []
+        state.count_below += 1
+        if state.count_below < self.hold_samples:
+            return []
+        self.channels[freq] = _ChannelState()
+        return [state.event()]
+
+    def flush(self):
+        # close all open events, e.g. at the end of the input
+        events = [state.event() for state in self.channels.values() if state.active]
+        self.channels.clear()
+        return events
+
+    def _span_and_peak(self, freq, noise, rssi, pwr):
+        if not pwr:
+            if isinstance(noise, float):
+                half_bandwidth = InterferenceDetector.ht40_half_bandwidth
+            else:
+                half_bandwidth = InterferenceDetector.ht20_half_bandwidth
+            return (freq - half_bandwidth, freq + half_bandwidth, noise + rssi)
+        level = noise + self.threshold_db
+        above = [f for (f, v) in pwr.items() if v >= level]
+        if not above:
+            above = (next(iter(pwr)), next(reversed(pwr)))
+        return (above[0], above[-1], max(pwr.values()))
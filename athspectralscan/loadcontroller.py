@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+import time
+import datetime
+import logging
+logger = logging.getLogger(__name__)
+
+
+class LoadController(object):
+
+    """ LoadController lets AthSpectralScanDecoder trade resolution for throughput, instead of falling behind
+    (gaps, growing queues, OOM) when the spectral activity is high, see set_load_controller() of the decoder.
+
+    The fidelities, from the best to the cheapest:
+     full - all bins, as without a controller
+     decimated - the power of each group of decimation bins (mean of the linear power), at the frequency of the
+                 first bin of the group
+     peak - only the strongest bin
+     metadata - no bins (tsf, freq, noise and rssi only, as disable_pwr_decoding())
+
+    Before each chunk is decoded the controller looks at the depth of the input queue and the lag (age of the chunk,
+    only known for live data). If one is above its limit (high_water, max_lag_sec), the fidelity is reduced by one
+    step, at most once per step_interval_sec, so the effect of a step can be seen before the next one. If both are
+    below half of their limits (low_water, max_lag_sec / 2) for recover_sec, the fidelity is raised by one step.
+    min_fidelity is the lowest fidelity to use.
+
+    Each decoded sample is tagged with its fidelity: (ts, (tsf, freq, noise, rssi, pwr), fidelity).
+    """
+
+    fidelities = ("full", "decimated", "peak", "metadata")
+
+    def __init__(self, high_water=100, low_water=None, max_lag_sec=2.0, step_interval_sec=1.0, recover_sec=5.0,
+                 decimation=4, min_fidelity="metadata"):
+        if min_fidelity not in LoadController.fidelities:
+            raise Exception("unknown fidelity '%s'. valid: %s" % (min_fidelity, ", ".join(LoadController.fidelities)))
+        if decimation < 1:
+            raise Exception("invalid decimation: %s" % decimation)
+        self.high_water = high_water
+        self.low_water = low_water if low_water is not None else high_water // 2
+        self.max_lag_sec = max_lag_sec
+        self.step_interval_sec = step_interval_sec
+        self.recover_sec = recover_sec
+        self.decimation = decimation
+        self.max_level = LoadController.fidelities.index(min_fidelity)
+        self.level = 0
+        self.last_step = None  # time of the last step down
+        self.relaxed_since = None  # start of the current period without pressure
+        self.steps = 0
+
+    def get_fidelity(self):
+        return LoadController.fidelities[self.level]
+
+    def update(self, queue_depth, ts=None, now=None):
+        # called per chunk: the depth of the input queue and the time stamp of the chunk. Returns the fidelity to use
+        if now is None:
+            now = time.monotonic()
+        lag = None
+        if isinstance(ts, datetime.datetime):  # live data. Recorded data has float time stamps, its age means nothing
+            lag = (datetime.datetime.now() - ts).total_seconds()
+        if queue_depth > self.high_water or (lag is not None and lag > self.max_lag_sec):
+            self.relaxed_since = None
+            if self.level < self.max_level and (self.last_step is None or
+                                                now - self.last_step >= self.step_interval_sec):
+                self._step(+1, queue_depth, lag)
+                self.last_step = now
+        elif queue_depth <= self.low_water and (lag is None or lag <= self.max_lag_sec / 2):
+            if self.relaxed_since is None:
+                self.relaxed_since = now
+            elif self.level > 0 and now - self.relaxed_since >= self.recover_sec:
+                self._step(-1, queue_depth, lag)
+                self.relaxed_since = now
+        else:
+            self.relaxed_since = None  # between the limits: keep the fidelity
+        return LoadController.fidelities[self.level]
+
+    def _step(self, direction, queue_depth, lag):
+        self.level += direction
+        self.steps += 1
+        logger.info("decode fidelity %s to '%s' (queue depth: %d, lag: %s)" %
+                    ("reduced" if direction > 0 else "raised", LoadController.fidelities[self.level],
+                     queue_depth, "%.2fs" % lag if lag is not None else "n/a"))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+import io
+import os
+import glob
+import json
+import pstats
+import cProfile
+import threading
+from collections import OrderedDict
+import logging
+logger = logging.getLogger(__name__)
+
+
+class StageTimers(object):
+
+    """ Accumulates the time spent per stage: stage -> [count, seconds]. Stages are ';' separated paths, e.g.
+    "decode;log10", so they can be written as collapsed stacks. """
+
+    def __init__(self):
+        self.stages = dict()
+
+    def add(self, stage, seconds, count=1):
+        entry = self.stages.get(stage)
+        if entry is None:
+            self.stages[stage] = [count, seconds]
+        else:
+            entry[0] += count
+            entry[1] += seconds
+
+    def merge(self, stages):
+        for stage, (count, seconds) in stages.items():
+            self.add(stage, seconds, count)
+
+
+class _ProfileSession(object):
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = "%s-%d-%d" % (name, os.getpid(), threading.get_ident())
+        self.timers = StageTimers()
+        self.cprofile = cProfile.Profile() if profiler.cprofile else None
+
+    def start(self):
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        return self
+
+    def stop(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(os.path.join(self.profiler.output_dir, self.name + Profiler.cprofile_suffix))
+        with open(os.path.join(self.profiler.output_dir, self.name + Profiler.timers_suffix), "w") as f:
+            json.dump(self.timers.stages, f)
+
+
+class Profiler(object):
+
+    """ Profiler collects per-stage timers (and optional cProfile data) of DataHub and the AthSpectralScanDecoder
+    workers, see set_profiler() of both. Each thread / worker process writes its results to output_dir when it ends,
+    report() and write_collapsed() merge all of them.
+
+    The stage timers are taken only if a profiler is set, otherwise the hot paths only pay for a "is None" check.
+    The pickling cost of the decoder output is estimated by pickling every pickle_sample_rate-th sample.
+    """
+
+    cprofile_suffix = ".prof"
+    timers_suffix = ".timers.json"
+
+    def __init__(self, output_dir, cprofile=False, pickle_sample_rate=16):
+        self.output_dir = output_dir
+        self.cprofile = cprofile
+        self.pickle_sample_rate = pickle_sample_rate
+        os.makedirs(output_dir, exist_ok=True)
+
+    def session(self, name):
+        # a profiling session for the current thread / process
+        return _ProfileSession(self, name).start()
+
+    def clear(self):
+        for filename in self._files(Profiler.cprofile_suffix) + self._files(Profiler.timers_suffix):
+            os.remove(filename)
+
+    def get_timers(self):
+        # merged timers of all sessions: stage -> [count, seconds]. Stages are prefixed by the session type
+        timers = StageTimers()
+        for filename in self._files(Profiler.timers_suffix):
+            prefix = os.path.basename(filename).split("-")[0]
+            with open(filename) as f:
+                for stage, (count, seconds) in json.load(f).items():
+                    timers.add(prefix + ";" + stage, seconds, count)
+        return timers.stages
+
+    def get_stats(self):
+        files = self._files(Profiler.cprofile_suffix)
+        if not files:
+            return None
+        return pstats.Stats(*files, stream=io.StringIO())
+
+    def report(self, top=25):
+        lines = ["%-50s %12s %12s %12s" % ("stage", "count", "total [s]", "per call [us]")]
+        for stage, (count, seconds) in sorted(self.get_timers().items()):
+            lines.append("%-50s %12d %12.3f %12.2f" % (stage, count, seconds, 1e6 * seconds / count if count else 0))
+        stats = self.get_stats()
+        if stats is not None:
+            stats.stream = io.StringIO()
+            stats.sort_stats("cumulative").print_stats(top)
+            lines.append("")
+            lines.append(stats.stream.getvalue())
+        return "\n".join(lines)
+
+    def write_collapsed(self, filename):
+        # collapsed stacks ("a;b;c <us>"), e.g. for flamegraph.pl: the stage timers + the (merged) cProfile data
+        with open(filename, "w") as f:
+            for stage, (count, seconds) in sorted(self.get_timers().items()):
+                f.write("stages;%s %d\n" % (stage, int(seconds * 1e6)))
+            stats = self.get_stats()
+            if stats is not None:
+                for stack, seconds in Profiler._collapse(stats).items():
+                    if seconds >= 1e-6:
+                        f.write("%s %d\n" % (stack, int(seconds * 1e6)))
+
+    @staticmethod
+    def _collapse(stats, max_depth=64):
+        # cProfile only knows caller->callee edges, not full stacks. Distribute the time of each function top-down
+        # along the edges (weighted by the cumulative time per edge), like flameprof does
+        callees = dict()
+        roots = []
+        for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+            if not callers:
+                roots.append(func)
+            for caller, edge in callers.items():
+                callees.setdefault(caller, []).append((func, edge[3]))
+        stacks = OrderedDict()
+
+        def name(func):
+            return "%s:%s" % (os.path.basename(func[0]), func[2])
+
+        def walk(func, seconds, path, seen):
+            (cc, nc, tt, ct, callers) = stats.stats[func]
+            if ct <= 0 or seconds <= 0:
+                return
+            path = path + (name(func),)
+            stack = ";".join(path)
+            stacks[stack] = stacks.get(stack, 0) + seconds * min(1.0, tt / ct)
+            if len(path) >= max_depth:
+                return
+            for (callee, edge_ct) in callees.get(func, []):
+                if callee not in seen:
+                    walk(callee, seconds * edge_ct / ct, path, seen | {callee})
+
+        for root in roots:
+            walk(root, stats.stats[root][3], (), {root})
+        return stacks
+
+    def _files(self, suffix):
+        return sorted(glob.glob(os.path.join(self.output_dir, "*" + suffix)))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+import sys
+import zlib
+import struct
+from array import array
+from collections import OrderedDict
+import logging
+logger = logging.getLogger(__name__)
+
+
+class SpectralDensity(object):
+
+    """ SpectralDensity accumulates a 2-D histogram of the decoded samples: how often each sub-carrier frequency saw
+    each power level (dBm bucket). This is the data behind a "density" waterfall.
+
+    The sub-carriers are placed on a global grid of 0.3125 MHz (the ath9k FFT bin width), so histograms of different
+    channels, HT modes or radios can be merged. Each row keeps the real frequency of its sub-carrier (the 2.4 GHz
+    channels are 0.125 MHz off the grid). Each row (sub-carrier) is an array of counters, the rows belonging to
+    a channel are cached, so an update costs one bucket calculation + increment per bin, without dict look-ups.
+
+    A histogram can be serialized via to_bytes() (zlib compressed, most counters are zero) and restored via
+    from_bytes(), e.g. to merge the results of several processes.
+    """
+
+    bin_width = 0.3125  # MHz
+    magic = b"ASD2"
+    header_format = "<4sddII"  # magic, min_dbm, resolution_db, nbuckets, nrows
+
+    def __init__(self, min_dbm=-150, max_dbm=0, resolution_db=1.0):
+        if max_dbm <= min_dbm or resolution_db <= 0:
+            raise Exception("invalid dBm range: %s..%s in steps of %s" % (min_dbm, max_dbm, resolution_db))
+        self.min_dbm = min_dbm
+        self.resolution_db = resolution_db
+        self.nbuckets = int(round((max_dbm - min_dbm) / resolution_db))
+        self.rows = dict()  # grid index (subcarrier freq / bin_width) -> array of counters, one per dBm bucket
+        self.frequencies = dict()  # grid index -> subcarrier freq of the row
+        self.row_cache = dict()  # (first subcarrier, number of bins) -> list of rows
+        self.sample_count = 0
+
+    def add(self, sample):
+        (ts, (tsf, freq, noise, rssi, pwr)) = sample[0:2]
+        if not pwr:
+            return
+        subcarrier_0 = next(iter(pwr))
+        rows = self.row_cache.get((subcarrier_0, len(pwr)))
+        if rows is None:
+            rows = [self._get_row(int(round(f / SpectralDensity.bin_width)), f) for f in pwr.keys()]
+            self.row_cache[(subcarrier_0, len(pwr))] = rows
+        min_dbm = self.min_dbm
+        scale = 1 / self.resolution_db
+        last = self.nbuckets - 1
+        for row, v in zip(rows, pwr.values()):
+            bucket = int((v - min_dbm) * scale)
+            if bucket < 0:
+                bucket = 0
+            elif bucket > last:
+                bucket = last
+            row[bucket] += 1
+        self.sample_count += 1
+
+    def add_samples(self, samples):
+        for sample in samples:
+            self.add(sample)
+
+    def merge(self, other):
+        if (other.min_dbm, other.resolution_db, other.nbuckets) != (self.min_dbm, self.resolution_db, self.nbuckets):
+            raise Exception("can not merge histograms with different dBm buckets!")
+        for index, other_row in other.rows.items():
+            row = self._get_row(index, other.frequencies[index])
+            for bucket, count in enumerate(other_row):
+                if count:
+                    row[bucket] += count
+        self.sample_count += other.sample_count
+
+    def get_frequencies(self):
+        return [self.frequencies[index] for index in sorted(self.rows.keys())]
+
+    def get_bucket_dbm(self, bucket):
+        return self.min_dbm + (bucket + 0.5) * self.resolution_db  # center of the bucket
+
+    def get_density(self):
+        # subcarrier freq -> list of counters (one per dBm bucket), sorted by frequency
+        return OrderedDict((self.frequencies[index], self.rows[index].tolist())
+                           for index in sorted(self.rows.keys()))
+
+    def reset(self):
+        for row in self.rows.values():
+            for bucket in range(self.nbuckets):
+                row[bucket] = 0
+        self.sample_count = 0
+
+    def to_bytes(self):
+        indexes = sorted(self.rows.keys())
+        header = struct.pack(SpectralDensity.header_format, SpectralDensity.magic, self.min_dbm,
+                             self.resolution_db, self.nbuckets, len(indexes))
+        keys = array('i', indexes)
+        frequencies = array('d', [self.frequencies[index] for index in indexes])
+        counts = array('I')
+        for index in indexes:
+            counts.extend(self.rows[index])
+        if sys.byteorder != "little":
+            keys.byteswap()
+            frequencies.byteswap()
+            counts.byteswap()
+        payload = struct.pack("<Q", self.sample_count) + keys.tobytes() + frequencies.tobytes() + counts.tobytes()
+        return header + zlib.compress(payload)
+
+    @staticmethod
+    def from_bytes(data):
+        (magic, min_dbm, resolution_db, nbuckets, nrows) = struct.unpack_from(SpectralDensity.header_format, data)
+        if magic != SpectralDensity.magic:
+            raise Exception("data is not a serialized SpectralDensity!")
+        payload = zlib.decompress(data[struct.calcsize(SpectralDensity.header_format):])
+        density = SpectralDensity(min_dbm=min_dbm, max_dbm=min_dbm + nbuckets * resolution_db,
+                                  resolution_db=resolution_db)
+        density.nbuckets = nbuckets
+        (density.sample_count,) = struct.unpack_from("<Q", payload)
+        keys = array('i')
+        keys.frombytes(payload[8:8 + 4 * nrows])
+        frequencies = array('d')
+        frequencies.frombytes(payload[8 + 4 * nrows:8 + 12 * nrows])
+        counts = array('I')
+        counts.frombytes(payload[8 + 12 * nrows:])
+        if sys.byteorder != "little":
+            keys.byteswap()
+            frequencies.byteswap()
+            counts.byteswap()
+        for n, index in enumerate(keys):
+            density.rows[index] = counts[n * nbuckets:(n + 1) * nbuckets]
+            density.frequencies[index] = frequencies[n]
+        return density
+
+    def _get_row(self, index, freq):
+        row = self.rows.get(index)
+        if row is None:
+            row = array('I', bytes(4 * self.nbuckets))
+            self.rows[index] = row
+            self.frequencies[index] = freq
+        return row
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+import math
+import datetime
+from array import array
+from collections import OrderedDict, deque
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _to_seconds(ts):
+    # live data is time stamped with datetime.now(), recorded data with a float (seconds)
+    if isinstance(ts, datetime.datetime):
+        return ts.timestamp()
+    return ts
+
+
+class _Pane(object):
+
+    """ Summary of all samples of one channel within one hop interval. Size is O(bins). """
+
+    def __init__(self, nbins, nbuckets):
+        self.count = 0
+        self.max = [-math.inf] * nbins
+        self.lin_sum = [0.0] * nbins
+        self.duty = [0] * nbins
+        self.hist = array('I', bytes(4 * nbins * nbuckets)) if nbuckets else None
+
+    def merge(self, other):
+        self.count += other.count
+        self.max = [a if a > b else b for (a, b) in zip(self.max, other.max)]
+        self.lin_sum = [a + b for (a, b) in zip(self.lin_sum, other.lin_sum)]
+        self.duty = [a + b for (a, b) in zip(self.duty, other.duty)]
+        if self.hist is not None:
+            for i, c in enumerate(other.hist):
+                if c:
+                    self.hist[i] += c
+
+
+class SpectrumAggregator(object):
+
+    """ SpectrumAggregator reduces the decoded samples of AthSpectralScanDecoder to per-channel summary statistics
+    over time windows. For each channel (center frequency) and window the result contains per sub-carrier:
+    max - max-hold value (dBm)
+    mean - mean value, averaged in the linear power domain (dBm)
+    percentiles - a dict percentile->values, estimated by a fixed-resolution histogram sketch (dBm)
+    duty - duty cycle: fraction of samples above duty_cycle_threshold (0..1)
+
+    The windows are tumbling (hop_sec=None) or sliding (window_sec must be a multiple of hop_sec). Internally the
+    samples are summarised in panes of hop_sec length, a sliding window is the merge of the last window_sec/hop_sec
+    panes. So the memory per channel is O(bins), regardless of the sample rate.
+
+    The windows are based on the userspace time stamp of the samples. Samples which arrive after their window was
+    already emitted (e.g. out-of-order samples of a multi process decoder) are dropped and counted in late_samples.
+    Samples without pwr values (see AthSpectralScanDecoder.disable_pwr_decoding()) are ignored.
+    """
+
+    def __init__(self, window_sec=1.0, hop_sec=None, percentiles=(50, 90), duty_cycle_threshold=-95,
+                 min_dbm=-150, max_dbm=0, resolution_db=1.0):
+        if hop_sec is None:
+            hop_sec = window_sec
+        panes = window_sec / hop_sec
+        if hop_sec <= 0 or panes < 1 or abs(panes - round(panes)) > 1e-9:
+            raise Exception("window_sec (%s) needs to be a multiple of hop_sec (%s)!" % (window_sec, hop_sec))
+        for p in percentiles:
+            if p < 0 or p > 100:
+                raise Exception("invalid percentile: %s. valid: 0-100" % p)
+        self.window_sec = window_sec
+        self.hop_sec = hop_sec
+        self.panes_per_window = int(round(panes))
+        self.percentiles = tuple(percentiles)
+        self.duty_cycle_threshold = duty_cycle_threshold
+        self.min_dbm = min_dbm
+        self.resolution_db = resolution_db
+        self.nbuckets = int(math.ceil((max_dbm - min_dbm) / resolution_db)) if self.percentiles else 0
+        self.output_queue = None
+        self.late_samples = 0
+        self.current_pane = None
+        # (freq, nbins) -> [subcarrier freqs, deque of (pane index, _Pane)]
+        self.channels = OrderedDict()
+
+    def set_output_queue(self, output_queue):
+        self.output_queue = output_queue
+
+    def add(self, sample):
+        (ts, (tsf, freq, noise, rssi, pwr)) = sample[0:2]
+        if not pwr:
+            return []
+        pane_index = int(math.floor(_to_seconds(ts) / self.hop_sec))
+        results = []
+        if self.current_pane is None:
+            self.current_pane = pane_index
+        elif pane_index > self.current_pane:
+            results = self._advance(pane_index)
+        elif pane_index < self.current_pane and self.panes_per_window == 1:
+            self.late_samples += 1
+            return results
+
+        key = (freq, len(pwr))
+        channel = self.channels.get(key)
+        if channel is None:
+            channel = [list(pwr.keys()), deque()]
+            self.channels[key] = channel
+        panes = channel[1]
+        pane = None
+        position = len(panes)
+        for n, (i, p) in enumerate(panes):
+            if i == pane_index:
+                pane = p
+                break
+            if i > pane_index:
+                position = n
+                break
+        if pane is None:
+            if pane_index < self.current_pane - self.panes_per_window + 1 or \
+                    (panes and pane_index < panes[0][0]):
+                self.late_samples += 1  # window of this pane was already emitted
+                return results
+            pane = _Pane(len(pwr), self.nbuckets)
+            panes.insert(position, (pane_index, pane))  # keep the panes sorted, a sample may arrive out-of-order
+        self._update_pane(pane, pwr.values())
+        return results
+
+    def add_samples(self, samples):
+        results = []
+        for sample in samples:
+            results.extend(self.add(sample))
+        return results
+
+    def flush(self):
+        # emit all windows which contain data, e.g. at the end of a recorded file
+        if self.current_pane is None:
+            return []
+        results = self._advance(self.current_pane + self.panes_per_window)
+        self.current_pane = None
+        self.channels.clear()
+        return results
+
+    def _update_pane(self, pane, values):
+        pane.count += 1
+        pane_max = pane.max
+        lin_sum = pane.lin_sum
+        duty = pane.duty
+        threshold = self.duty_cycle_threshold
+        hist = pane.hist
+        nbuckets = self.nbuckets
+        for i, v in enumerate(values):
+            if v > pane_max[i]:
+                pane_max[i] = v
+            lin_sum[i] += 10 ** (v / 10)
+            if v > threshold:
+                duty[i] += 1
+            if hist is not None:
+                bucket = int((v - self.min_dbm) / self.resolution_db)
+                if bucket < 0:
+                    bucket = 0
+                elif bucket >= nbuckets:
+                    bucket = nbuckets - 1
+                hist[i * nbuckets + bucket] += 1
+
+    def _advance(self, new_pane):
+        # close all panes before new_pane and emit the windows ending there
+        results = []
+        for key, (subcarriers, panes) in self.channels.items():
+            if not panes:
+                continue
+            if self.panes_per_window == 1:
+                while panes and panes[0][0] < new_pane:
+                    (i, pane) = panes.popleft()
+                    results.append(self._result(key[0], subcarriers, i, pane))
+                continue
+            # sliding window: emit one window per hop, as long as it contains at least one pane
+            last = min(new_pane - 1, panes[-1][0] + self.panes_per_window - 1)
+            end = max(self.current_pane, panes[0][0])
+            while end <= last:
+                first = end - self.panes_per_window + 1
+                while panes and panes[0][0] < first:
+                    panes.popleft()
+                if not panes:
+                    break
+                if panes[0][0] <= end:
+                    merged = _Pane(len(subcarriers), self.nbuckets)
+                    for (i, pane) in panes:
+                        if i <= end:
+                            merged.merge(pane)
+                    results.append(self._result(key[0], subcarriers, first, merged))
+                end += 1
+            while panes and panes[0][0] < new_pane - self.panes_per_window + 1:
+                panes.popleft()
+        self.current_pane = new_pane
+        if self.output_queue is not None:
+            for result in results:
+                self.output_queue.put(result)
+        return results
+
+    def _result(self, freq, subcarriers, first_pane, pane):
+        n = pane.count
+        result = {
+            'start': first_pane * self.hop_sec,
+            'end': first_pane * self.hop_sec + self.window_sec,
+            'freq': freq,
+            'count': n,
+            'max': OrderedDict(zip(subcarriers, pane.max)),
+            'mean': OrderedDict((f, 10 * math.log10(s / n)) for (f, s) in zip(subcarriers, pane.lin_sum)),
+            'duty': OrderedDict((f, d / n) for (f, d) in zip(subcarriers, pane.duty)),
+            'percentiles': {},
+        }
+        for p in self.percentiles:
+            rank = max(1, int(math.ceil(p / 100 * n)))
+            values = OrderedDict()
+            for b, f in enumerate(subcarriers):
+                offset = b * self.nbuckets
+                cumsum = 0
+                for bucket in range(self.nbuckets):
+                    cumsum += pane.hist[offset + bucket]
+                    if cumsum >= rank:
+                        break
+                values[f] = self.min_dbm + (bucket + 0.5) * self.resolution_db  # center of the bucket
+            result['percentiles'][p] = values
+        return result
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+import sys
+import zlib
+import struct
+import operator
+import datetime
+from array import array
+from itertools import accumulate
+from collections import OrderedDict
+import logging
+logger = logging.getLogger(__name__)
+
+bin_width = 0.3125  # MHz
+batch_header = struct.Struct("<4sIfIB")  # magic, number of samples, step_db, total number of bins, flags
+batch_magic = b"ASZ1"
+frame_length = struct.Struct("<I")  # batches on a stream: <I length><batch>
+max_quantized = 16383  # |dBm / step_db|, so the deltas fit into int16
+FLAG_DELTA = 1  # pwr rows are deltas to the previous row of the same channel
+
+
+def _to_seconds(ts):
+    if isinstance(ts, datetime.datetime):
+        return ts.timestamp()
+    return ts
+
+
+def _little_endian(a):
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a.tobytes()
+
+
+def _from_little_endian(typecode, data, pos, count):
+    a = array(typecode)
+    end = pos + a.itemsize * count
+    a.frombytes(data[pos:end])
+    if sys.byteorder != "little":
+        a.byteswap()
+    return (a, end)
+
+
+def encode_batch(samples, step_db=0.5, level=6):
+    """ Encode decoded samples into one self-contained, compressed batch:
+    the pwr values are quantized to step_db (error <= step_db / 2), delta-encoded against the previous spectrum of the
+    same channel (and bin layout) in the batch and stored as int16 in two byte planes (low / high bytes), so zlib
+    sees long runs of equal high bytes. tsf is delta-encoded, the other fields are stored as columns.
+    For noise-like spectra the deltas are more random than the values, so both are compressed and the smaller one
+    is kept.
+    """
+    ts = array('d')
+    tsf = array('Q')
+    freq = array('H')
+    noise2 = array('h')  # 2x noise / rssi: HT40 values are averages of 2 ints
+    rssi2 = array('h')
+    nbins = array('H')
+    first = array('h')  # first bin, in bin widths relative to freq
+    stride = array('B')  # distance of the bins, in bin widths (decimated / peak-only fidelities)
+    values = array('h')
+    deltas = array('h')
+    scale = 1 / step_db
+    previous = dict()  # (freq, nbins, first, stride) -> quantized spectrum
+    last_tsf = 0
+    for sample in samples:
+        (s_ts, (s_tsf, s_freq, s_noise, s_rssi, s_pwr)) = sample[0:2]
+        ts.append(_to_seconds(s_ts))
+        tsf.append((s_tsf - last_tsf) & 0xffffffffffffffff)
+        last_tsf = s_tsf
+        freq.append(s_freq)
+        noise2.append(int(s_noise * 2))
+        rssi2.append(int(s_rssi * 2))
+        nbins.append(len(s_pwr))
+        if not s_pwr:
+            first.append(0)
+            stride.append(0)
+            continue
+        keys = iter(s_pwr)
+        f0 = next(keys)
+        f1 = next(keys, f0 + bin_width)
+        first.append(int(round((f0 - s_freq) / bin_width)))
+        stride.append(int(round((f1 - f0) / bin_width)))
+        q = [max(-max_quantized, min(max_quantized, int(round(v * scale)))) for v in s_pwr.values()]
+        key = (s_freq, len(q), first[-1], stride[-1])
+        last = previous.get(key)
+        values.extend(q)
+        deltas.extend(map(operator.sub, q, last) if last is not None else q)
+        previous[key] = q
+    columns = b"".join([_little_endian(a) for a in (ts, tsf, freq, noise2, rssi2, nbins, first, stride)])
+    best = None
+    for (flags, rows) in ((0, values), (FLAG_DELTA, deltas)):
+        raw = _little_endian(rows)
+        batch = batch_header.pack(batch_magic, len(ts), step_db, len(rows), flags) + \
+            zlib.compress(b"".join((columns, raw[0::2], raw[1::2])), level)
+        if best is None or len(batch) < len(best):
+            best = batch
+    return best
+
+
+class SpectrumBatch(object):
+
+    """ A decoded batch of encode_batch() as arrays, one entry per sample: ts, tsf, freq, noise, rssi, nbins, first
+    (frequency of the first bin), stride (bin distance in MHz), offsets (of the rows in pwr) and pwr, the float32 dBm
+    values of all samples. row(i) returns the pwr values of sample i, iterating yields the samples in the regular
+    decoder format (ts, (tsf, freq, noise, rssi, pwr)), with quantized pwr values.
+    """
+
+    def __init__(self, ts, tsf, freq, noise, rssi, nbins, first, stride, offsets, pwr):
+        self.ts = ts
+        self.tsf = tsf
+        self.freq = freq
+        self.noise = noise
+        self.rssi = rssi
+        self.nbins = nbins
+        self.first = first
+        self.stride = stride
+        self.offsets = offsets
+        self.pwr = pwr
+
+    def __len__(self):
+        return len(self.ts)
+
+    def __iter__(self):
+        for i in range(len(self.ts)):
+            yield self.sample(i)
+
+    def row(self, i):
+        return self.pwr[self.offsets[i]:self.offsets[i] + self.nbins[i]]
+
+    def sample(self, i):
+        (f0, df) = (self.first[i], self.stride[i])
+        pwr = OrderedDict((f0 + n * df, v) for n, v in enumerate(self.row(i)))
+        return (self.ts[i], (self.tsf[i], self.freq[i], self.noise[i], self.rssi[i], pwr))
+
+    @staticmethod
+    def from_bytes(data):
+        (magic, count, step_db, total_bins, flags) = batch_header.unpack_from(data)
+        if magic != batch_magic:
+            raise Exception("data is not an encoded spectrum batch!")
+        payload = zlib.decompress(data[batch_header.size:])
+        pos = 0
+        (ts, pos) = _from_little_endian('d', payload, pos, count)
+        (tsf_deltas, pos) = _from_little_endian('Q', payload, pos, count)
+        (freq, pos) = _from_little_endian('H', payload, pos, count)
+        (noise2, pos) = _from_little_endian('h', payload, pos, count)
+        (rssi2, pos) = _from_little_endian('h', payload, pos, count)
+        (nbins, pos) = _from_little_endian('H', payload, pos, count)
+        (first, pos) = _from_little_endian('h', payload, pos, count)
+        (stride, pos) = _from_little_endian('B', payload, pos, count)
+        raw = bytearray(2 * total_bins)
+        raw[0::2] = payload[pos:pos + total_bins]
+        raw[1::2] = payload[pos + total_bins:pos + 2 * total_bins]
+        (rows, _) = _from_little_endian('h', raw, 0, total_bins)
+
+        tsf = array('Q', accumulate(tsf_deltas, lambda a, b: (a + b) & 0xffffffffffffffff))
+        noise = array('d', map((0.5).__mul__, noise2))
+        rssi = array('d', map((0.5).__mul__, rssi2))
+        offsets = array('I', accumulate(nbins, initial=0))
+        first_freq = array('d', [f + b * bin_width for f, b in zip(freq, first)])
+        stride_mhz = array('d', map(bin_width.__mul__, stride))
+        if flags & FLAG_DELTA:
+            # undo the delta encoding: a row is the sum of its delta and the previous row of the same channel
+            quantized = array('i', bytes(4 * total_bins))
+            previous = dict()
+            for i in range(count):
+                (start, end) = (offsets[i], offsets[i + 1])
+                if start == end:
+                    continue
+                key = (freq[i], end - start, first[i], stride[i])
+                last = previous.get(key)
+                if last is None:
+                    quantized[start:end] = array('i', rows[start:end])
+                else:
+                    quantized[start:end] = array('i', map(operator.add, quantized[last[0]:last[1]], rows[start:end]))
+                previous[key] = (start, end)
+        else:
+            quantized = rows
+        pwr = array('f', map(float(step_db).__mul__, quantized))
+        return SpectrumBatch(ts, tsf, freq, noise, rssi, nbins, first_freq, stride_mhz, offsets, pwr)
+
+
+class CompressedSpectrumSink(object):
+
+    """ CompressedSpectrumSink compresses decoded samples for a slow (network) link: the samples are collected in
+    batches of batch_size samples, each batch is encoded by encode_batch() (quantized to step_db, delta-encoded per
+    channel, zlib) and written as <I length><batch> to output, a file-like object (e.g. socket.makefile("wb")).
+    Each batch can be decoded on its own, see read_batches() and SpectrumBatch.
+    """
+
+    def __init__(self, output, batch_size=256, step_db=0.5, level=6):
+        if step_db <= 0:
+            raise Exception("invalid step: %s dB" % step_db)
+        self.output = output
+        self.batch_size = batch_size
+        self.step_db = step_db
+        self.level = level
+        self.samples = []
+        self.bytes_in = 0  # size of the pwr values as float32, for get_ratio()
+        self.bytes_out = 0
+
+    def add(self, sample):
+        self.samples.append(sample)
+        if len(self.samples) >= self.batch_size:
+            self.flush()
+
+    def add_samples(self, samples):
+        for sample in samples:
+            self.add(sample)
+
+    def write_samples(self, samples):
+        # sink interface for batches of decoded samples
+        self.add_samples(samples)
+
+    def flush(self):
+        if not self.samples:
+            return
+        batch = encode_batch(self.samples, step_db=self.step_db, level=self.level)
+        self.output.write(frame_length.pack(len(batch)))
+        self.output.write(batch)
+        self.bytes_in += sum(4 * len(sample[1][4]) + 28 for sample in self.samples)  # ~ SpectrumServer frame
+        self.bytes_out += frame_length.size + len(batch)
+        self.samples = []
+
+    def get_ratio(self):
+        # compression ratio so far, against the uncompressed (float32) sample frames of SpectrumServer
+        return self.bytes_in / self.bytes_out if self.bytes_out else 0
+
+    def close(self):
+        self.flush()
+        self.output.flush()
+
+
+def read_batches(stream):
+    # SpectrumBatch per batch of a CompressedSpectrumSink output, until the end of the stream
+    while True:
+        header = stream.read(frame_length.size)
+        if len(header) < frame_length.size:
+            return
+        (length,) = frame_length.unpack(header)
+        data = stream.read(length)
+        if len(data) < length:
+            logger.warning("incomplete batch at the end of the stream")
+            return
+        yield SpectrumBatch.from_bytes(data)
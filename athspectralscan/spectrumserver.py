@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+import os
+import sys
+import json
+import queue
+import socket
+import struct
+import datetime
+import threading
+from array import array
+from collections import OrderedDict
+from .athspectralscandecoder import AthSpectralScanDecoder
+from .loadcontroller import LoadController
+import logging
+logger = logging.getLogger(__name__)
+
+# frame: <B type><I payload length><payload>
+frame_header = struct.Struct("<BI")
+FRAME_SAMPLE = 1  # <d ts><Q tsf><H freq><f noise><f rssi><H nbins><h first><B stride><B fidelity> + nbins x <f pwr>
+FRAME_RAW = 2     # <d ts> + raw spectral data, as read from spectral_scan0
+FRAME_EVENT = 3   # <Q start_tsf><Q end_tsf><d freq_lo><d freq_hi><d peak_dbm>
+sample_header = struct.Struct("<dQHffHhBB")
+bin_width = 0.3125  # MHz
+raw_header = struct.Struct("<d")
+event_format = struct.Struct("<QQddd")
+
+
+def _to_seconds(ts):
+    if isinstance(ts, datetime.datetime):
+        return ts.timestamp()
+    return ts
+
+
+def encode_sample(sample):
+    # first: the first bin, in bin widths relative to freq. stride: distance of the bins, in bin widths (the
+    # decimated / peak fidelities of LoadController). fidelity: 0 (untagged) or 1 + index in LoadController.fidelities
+    (ts, (tsf, freq, noise, rssi, pwr)) = sample[0:2]
+    values = array('f', pwr.values())
+    if sys.byteorder != "little":
+        values.byteswap()
+    (first, stride) = (0, 1)
+    if pwr:
+        keys = iter(pwr)
+        f0 = next(keys)
+        f1 = next(keys, f0 + bin_width)
+        first = int(round((f0 - freq) / bin_width))
+        stride = int(round((f1 - f0) / bin_width))
+    fidelity = LoadController.fidelities.index(sample[2]) + 1 if len(sample) > 2 else 0
+    payload = sample_header.pack(_to_seconds(ts), tsf, freq, noise, rssi, len(values), first, stride, fidelity) + \
+        values.tobytes()
+    return frame_header.pack(FRAME_SAMPLE, len(payload)) + payload
+
+
+def encode_raw(ts, data):
+    # header and data are sent one after another, so the (large) chunk is not copied
+    return (frame_header.pack(FRAME_RAW, raw_header.size + len(data)) + raw_header.pack(_to_seconds(ts)), data)
+
+
+def encode_event(event):
+    return frame_header.pack(FRAME_EVENT, event_format.size) + event_format.pack(*event)
+
+
+def decode_frame(frame_type, payload):
+    if frame_type == FRAME_SAMPLE:
+        (ts, tsf, freq, noise, rssi, nbins, first, stride, fidelity) = sample_header.unpack_from(payload)
+        values = array('f')
+        values.frombytes(payload[sample_header.size:sample_header.size + 4 * nbins])
+        if sys.byteorder != "little":
+            values.byteswap()
+        subcarrier_0 = freq + first * bin_width
+        pwr = OrderedDict((subcarrier_0 + i * stride * bin_width, v) for i, v in enumerate(values))
+        if fidelity:
+            return (ts, (tsf, freq, noise, rssi, pwr), LoadController.fidelities[fidelity - 1])
+        return (ts, (tsf, freq, noise, rssi, pwr))
+    if frame_type == FRAME_RAW:
+        (ts,) = raw_header.unpack_from(payload)
+        return (ts, payload[raw_header.size:])
+    if frame_type == FRAME_EVENT:
+        return event_format.unpack(payload)
+    raise Exception("unknown frame type: %d" % frame_type)
+
+
+class _Subscriber(object):
+
+    def __init__(self, server, connection, config):
+        self.server = server
+        self.connection = connection
+        self.kind = config.get("type", "decoded")
+        self.decimate = max(1, int(config.get("decimate", 1)))
+        freq = config.get("freq")
+        if freq is not None and not isinstance(freq, list):
+            freq = [freq, freq]
+        self.freq = freq
+        self.queue = queue.Queue(maxsize=int(config.get("queue", 1000)))
+        self.counter = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._send, args=())
+        self.thread.daemon = True
+
+    def wants(self, kind, freq):
+        if kind != self.kind and not (kind == "event" and self.kind == "decoded"):
+            return False
+        if self.freq is not None and freq is not None and not self.freq[0] <= freq <= self.freq[1]:
+            return False
+        if kind == "event":
+            return True  # events are rare, never decimate them
+        self.counter += 1
+        return (self.counter - 1) % self.decimate == 0
+
+    def offer(self, frame):
+        try:
+            self.queue.put_nowait(frame)
+        except queue.Full:
+            self.dropped += 1  # slow subscriber: drop instead of blocking the publisher
+
+    def close(self, timeout):
+        # let the sender deliver the queued frames for up to timeout sec, then abort it. A sender blocked in
+        # sendall() (the subscriber stopped reading) is only woken up by the shutdown
+        try:
+            self.queue.put_nowait(None)
+            self.thread.join(timeout)
+        except queue.Full:
+            pass
+        if self.thread.is_alive():
+            try:
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # already disconnected
+            self.thread.join()
+
+    def _send(self):
+        try:
+            while True:
+                frame = self.queue.get()
+                if frame is None:
+                    break
+                if isinstance(frame, tuple):
+                    for part in frame:
+                        self.connection.sendall(part)
+                else:
+                    self.connection.sendall(frame)
+        except OSError as e:
+            logger.debug("subscriber disconnected: %s" % e)
+        finally:
+            self.connection.close()
+            self.server._remove(self)
+            if self.dropped:
+                logger.info("subscriber dropped %d frames (too slow)" % self.dropped)
+
+
+class SpectrumServer(object):
+
+    """ SpectrumServer publishes decoded samples, detector events and raw chunks over a local socket to any number of
+    subscribers, so several processes can share one sensor without decoding the data again.
+
+    address is a path (Unix socket) or a (host, port) tuple (TCP). A subscriber (see SpectrumClient) sends one JSON
+    line after connecting (within handshake_timeout_sec): {"type": "decoded" | "raw", "decimate": n,
+    "freq": f or [min, max], "queue": size}.
+    Subscribers of decoded samples also get the detector events. Each subscriber has its own bounded queue and sender
+    thread, if it is too slow the frames for it are dropped, the publisher is never blocked.
+
+    The frames are binary: <B type><I length><payload>, see encode_sample(), encode_raw() and encode_event().
+    """
+
+    close_timeout_sec = 1.0  # on stop(): time for each subscriber to receive its queued frames
+    handshake_timeout_sec = 5.0  # time for a new subscriber to send its subscription
+
+    def __init__(self, address):
+        self.address = address
+        self.socket = None
+        self.accept_thread = None
+        self.pump_thread = None
+        self.subscribers = []
+        self.handshakes = dict()  # connection -> thread, which reads the subscription
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.socket is not None:
+            return
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(self.address)
+        self.socket.listen(8)
+        self.accept_thread = threading.Thread(target=self._accept, args=())
+        self.accept_thread.daemon = True
+        self.accept_thread.start()
+
+    def stop(self):
+        if self.socket is None:
+            return
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)  # wake up the accept thread
+        except OSError:
+            pass
+        self.socket.close()
+        self.accept_thread.join()
+        with self.lock:
+            self.socket = None  # no new subscribers
+            handshakes = list(self.handshakes.items())
+        for (connection, thread) in handshakes:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)  # wake up the handshake thread
+            except OSError:
+                pass
+            thread.join()
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.close(SpectrumServer.close_timeout_sec)
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def get_address(self):
+        # the bound address, e.g. to get the port if port 0 was requested
+        return self.socket.getsockname()
+
+    def get_number_of_subscribers(self):
+        return len(self.subscribers)
+
+    def publish(self, sample):
+        self._publish("decoded", sample[1][1], encode_sample, sample)
+
+    def publish_raw(self, ts, data):
+        self._publish("raw", None, encode_raw, ts, data)
+
+    def write_chunk(self, ts, data, header=None):
+        # sink interface of DataHub
+        self.publish_raw(ts, data)
+
+    def publish_event(self, event):
+        self._publish("event", (event[2] + event[3]) / 2, encode_event, event)
+
+    def attach(self, output_queue):
+        # publish everything of a decoder output queue, until the end of the stream
+        self.pump_thread = threading.Thread(target=self._pump, args=(output_queue,))
+        self.pump_thread.daemon = True
+        self.pump_thread.start()
+
+    def _pump(self, output_queue):
+        while True:
+            item = output_queue.get()
+            if item is AthSpectralScanDecoder.end_of_stream_marker:
+                break
+            if isinstance(item[1], tuple):
+                self.publish(item)
+            else:
+                self.publish_event(item)
+
+    def _publish(self, kind, freq, encode, *args):
+        frame = None
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            if subscriber.wants(kind, freq):
+                if frame is None:
+                    frame = encode(*args)  # encode once, share the frame with all subscribers
+                subscriber.offer(frame)
+
+    def _accept(self):
+        while True:
+            try:
+                (connection, address) = self.socket.accept()
+            except OSError:
+                break  # socket closed
+            # read the subscription in its own thread, so a client which sends nothing does not block the others
+            thread = threading.Thread(target=self._handshake, args=(connection,))
+            thread.daemon = True
+            with self.lock:
+                self.handshakes[connection] = thread
+            thread.start()
+
+    def _handshake(self, connection):
+        config = None
+        try:
+            connection.settimeout(SpectrumServer.handshake_timeout_sec)
+            with connection.makefile("rb") as f:
+                config = json.loads(f.readline().decode("utf-8") or "{}")
+            connection.settimeout(None)
+        except (OSError, ValueError) as e:
+            logger.warning("invalid subscription: %s" % e)
+        with self.lock:
+            del self.handshakes[connection]
+            if config is None or self.socket is None:  # invalid or the server was stopped meanwhile
+                connection.close()
+                return
+            subscriber = _Subscriber(self, connection, config)
+            self.subscribers.append(subscriber)
+            subscriber.thread.start()
+        logger.debug("new subscriber: %s" % config)
+
+    def _remove(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+
+class SpectrumClient(object):
+
+    """ SpectrumClient subscribes to a SpectrumServer. Iterating yields the decoded samples (as the decoder output,
+    with float32 pwr values), detector events or raw chunks (ts, data), depending on the subscription.
+    """
+
+    def __init__(self, address, kind="decoded", decimate=1, freq=None, queue_size=1000):
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.connect(address)
+        config = {"type": kind, "decimate": decimate, "freq": freq, "queue": queue_size}
+        self.socket.sendall((json.dumps(config) + "\n").encode("utf-8"))
+        self.stream = self.socket.makefile("rb")
+
+    def __iter__(self):
+        while True:
+            item = self.read()
+            if item is None:
+                break
+            yield item
+
+    def read(self):
+        # returns the next item or None, if the server closed the connection
+        header = self.stream.read(frame_header.size)
+        if len(header) < frame_header.size:
+            return None
+        (frame_type, length) = frame_header.unpack(header)
+        payload = self.stream.read(length)
+        if len(payload) < length:
+            return None
+        return decode_frame(frame_type, payload)
+
+    def close(self):
+        self.stream.close()
+        self.socket.close()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+import datetime
+from collections import deque
+import logging
+logger = logging.getLogger(__name__)
+
+
+class TSFClock(object):
+
+    """ TSFClock reconstructs a wall-clock time stamp for each sample from its TSF value.
+
+    DataHub stamps a whole chunk read from spectral_scan0 with one userspace time stamp, so all samples of a chunk
+    share the same ts. TSFClock fits the (microsecond) TSF counter to the host time: host = offset + rate * tsf.
+    Each chunk gives an anchor (max TSF of the chunk, ts), one anchor per anchor_interval_sec is kept. The ts is
+    taken after the samples were produced, so it is an upper bound: the rate (drift) is a least squares fit over the
+    recent anchors, the offset is the lower envelope.
+
+    TSF resets (e.g. interface down/up) start a new fit, TSF wraps (see tsf_bits) are unwrapped.
+    With short_repeat=True, samples with the same TSF are corrected by adding +4us per sample.
+
+    The input are decoded samples (in order, e.g. from a single process decoder), live or replayed from a dump file.
+    The output are the same samples, with ts replaced by the reconstructed time stamp (float, seconds since epoch) and
+    the corrected TSF.
+    """
+
+    short_repeat_us = 4
+    max_drift = 500e-6  # 500 ppm, fits beyond that are ignored (nominal rate is used)
+
+    def __init__(self, short_repeat=False, history=64, anchor_interval_sec=0.1, min_span_sec=1.0,
+                 reset_tolerance_us=1000000, tsf_bits=64):
+        self.short_repeat = short_repeat
+        self.history = history
+        self.anchor_interval_sec = anchor_interval_sec
+        self.min_span_sec = min_span_sec
+        self.reset_tolerance_us = reset_tolerance_us
+        self.tsf_bits = tsf_bits
+        self.resets = 0
+        self._reset()
+        self.tsf_epoch = 0  # added to the TSF after a wrap
+
+    def _reset(self):
+        self.anchors = deque(maxlen=self.history)  # (tsf in sec - x0, host ts - y0)
+        self.x0 = None
+        self.y0 = None
+        self.rate = 1.0
+        self.offset = 0.0
+        self.last_tsf = None
+        self.last_host = None
+        self.repeat_tsf = None
+        self.repeat_count = 0
+
+    def set_short_repeat(self, flag):
+        self.short_repeat = flag
+
+    def process(self, samples):
+        # split the input in chunks (same userspace time stamp) and handle them one after another
+        result = []
+        start = 0
+        for i in range(1, len(samples) + 1):
+            if i == len(samples) or samples[i][0] != samples[start][0]:
+                result.extend(self._process_chunk(samples[start:i]))
+                start = i
+        return result
+
+    def process_sample(self, sample):
+        return self._process_chunk([sample])[0]
+
+    def to_host_time(self, tsf):
+        return self.y0 + self.offset + self.rate * ((tsf + self.tsf_epoch) / 1e6 - self.x0)
+
+    def _process_chunk(self, chunk):
+        host = chunk[0][0]
+        if isinstance(host, datetime.datetime):
+            host = host.timestamp()
+
+        # unwrap the TSF sample by sample (a narrow counter may wrap inside a chunk), detect resets at the chunk start
+        tsfs = []
+        last = self.last_tsf
+        for (n, sample) in enumerate(chunk):
+            tsf = sample[1][0] + self.tsf_epoch
+            if last is not None and tsf < last - self.reset_tolerance_us:
+                if self.tsf_bits < 64 and last - tsf > 2 ** (self.tsf_bits - 1):
+                    self.tsf_epoch += 2 ** self.tsf_bits
+                    tsf += 2 ** self.tsf_bits
+                elif n == 0:
+                    self._new_segment("TSF jumped back from %d to %d" % (last, tsf))
+            elif n == 0 and last is not None and (tsf - last) / 1e6 > host - self.last_host + \
+                    self.reset_tolerance_us / 1e6:
+                self._new_segment("TSF jumped forward from %d to %d" % (last, tsf))
+            tsfs.append(tsf)
+            last = tsf
+
+        # short repeat: all samples of a FFT period carry the same TSF -> +4us per sample
+        repeats = [0] * len(tsfs)
+        if self.short_repeat:
+            for (i, tsf) in enumerate(tsfs):
+                if tsf == self.repeat_tsf:
+                    self.repeat_count += 1
+                else:
+                    self.repeat_tsf = tsf
+                    self.repeat_count = 0
+                repeats[i] = self.repeat_count * TSFClock.short_repeat_us
+
+        self.last_tsf = max(tsf + repeat for (tsf, repeat) in zip(tsfs, repeats))
+        self.last_host = host
+        self._add_anchor(self.last_tsf / 1e6, host)
+
+        y0 = self.y0 + self.offset
+        x0 = self.x0
+        rate = self.rate
+        return [(y0 + rate * ((tsf + repeat) / 1e6 - x0), (sample[1][0] + repeat,) + sample[1][1:]) + tuple(sample[2:])
+                for (tsf, repeat, sample) in zip(tsfs, repeats, chunk)]
+
+    def _new_segment(self, reason):
+        logger.debug("TSF reset detected (%s), restart clock fit" % reason)
+        self.resets += 1
+        epoch = self.tsf_epoch
+        self._reset()
+        self.tsf_epoch = epoch
+
+    def _add_anchor(self, x, y):
+        if self.x0 is None:
+            self.x0 = x
+            self.y0 = y
+        x -= self.x0
+        y -= self.y0
+        # keep one anchor per anchor_interval_sec (the one with the smallest delay), so the history spans some time
+        if self.anchors and int(x / self.anchor_interval_sec) == int(self.anchors[-1][0] / self.anchor_interval_sec):
+            if y - x < self.anchors[-1][1] - self.anchors[-1][0]:
+                self.anchors[-1] = (x, y)
+        else:
+            self.anchors.append((x, y))
+
+        # rate: least squares over the anchors, if they span enough time. Otherwise keep the current rate
+        n = len(self.anchors)
+        mean_x = sum(a[0] for a in self.anchors) / n
+        span = self.anchors[-1][0] - self.anchors[0][0]
+        if n > 2 and span >= self.min_span_sec:
+            mean_y = sum(a[1] for a in self.anchors) / n
+            sxx = sum((a[0] - mean_x) ** 2 for a in self.anchors)
+            sxy = sum((a[0] - mean_x) * (a[1] - mean_y) for a in self.anchors)
+            rate = sxy / sxx
+            if abs(rate - 1.0) <= TSFClock.max_drift:
+                self.rate = rate
+        # offset: the ts is the upper bound of the sample time -> use the lower envelope
+        self.offset = min(a[1] - self.rate * a[0] for a in self.anchors)
@@ -22,9 +22,7 @@
 
 from athspectralscan import AthSpectralScanner, DataHub,  AthSpectralScanDecoder
 import multiprocessing as mp
-import queue
 import logging
-import time
 import sys
 import os
 
@@ -44,6 +42,7 @@ def decode_samples(dump_file, output_file):
     decoder = AthSpectralScanDecoder()
     decoder.set_number_of_processes(1)  # so we do not need to sort the results by TSF
     decoder.set_output_queue(work_queue)
+    decoder.set_end_of_stream_marker(True)  # get a marker after the last sample
     # decoder.disable_pwr_decoding(True)   # enable to extract "metadata": time (TSF), frequency, etc  (much faster!)
     decoder.start()
 
@@ -53,20 +52,16 @@ def decode_samples(dump_file, output_file):
     logger.info("Start to decode samples from '%s' ..." % dump_file)
     with open(output_file, "wt") as f:
         while True:
-            try:
-                (ts, (tsf, freq, noise, rssi, pwr)) = work_queue.get(block=False)
-                # pwr is a OrderedDict. flat it
-                power = ",".join(["%.2f" % p for (freq, p) in pwr.items()])
-                s = "%s,%s,%s,%s,%s,%s\n" % (ts, tsf, freq, noise, rssi, power)
-                f.write(s)
-            except queue.Empty:
-                if decoder.is_finished():  # only break if decoder is finished AND queue is empty
-                    break
-                else:
-                    time.sleep(0.1)  # wait for new data
-                    continue
+            sample = work_queue.get()
+            if sample is AthSpectralScanDecoder.end_of_stream_marker:
+                break  # DataHub hit the end of the file and the decoder delivered all samples
+            (ts, (tsf, freq, noise, rssi, pwr)) = sample
+            # pwr is a OrderedDict. flat it
+            power = ",".join(["%.2f" % p for (freq, p) in pwr.items()])
+            s = "%s,%s,%s,%s,%s,%s\n" % (ts, tsf, freq, noise, rssi, power)
+            f.write(s)
     hub.stop()
-    decoder.stop()
+    decoder.join()
     logger.info("Decoded samples for '%s' written to '%s'" % (dump_file, output_file))
 
 
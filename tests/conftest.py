@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+import os
+import csv
+import struct
+import random
+import pytest
+from collections import OrderedDict
+
+examples_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+dump_file = os.path.join(examples_dir, "dump.bin")
+golden_file = os.path.join(examples_dir, "dump.csv")
+
+
+def read_records(filename):
+    # the records of a dump file: [(ts, data), ...], see DataHub
+    records = []
+    with open(filename, "rb") as f:
+        data = f.read()
+    pos = 0
+    while pos + 12 <= len(data):
+        (ts, length) = struct.unpack_from("<QI", data, pos)
+        records.append((ts / 1e9, data[pos + 12:pos + 12 + length]))
+        pos += 12 + length
+    return records
+
+
+def to_row(sample):
+    # a decoded sample in the format of examples/dump.csv, without the time stamp
+    (ts, (tsf, freq, noise, rssi, pwr)) = sample[0:2]
+    return [str(tsf), str(freq), str(noise), str(rssi)] + ["%.2f" % p for p in pwr.values()]
+
+
+def spectrum_sample(ts, tsf, values, freq=2412, noise=-95, rssi=20):
+    # a decoded sample (see AthSpectralScanDecoder), values: dBm of the bins, centered on freq
+    subcarrier_0 = freq - len(values) / 2 * 0.3125
+    pwr = OrderedDict((subcarrier_0 + i * 0.3125, v) for (i, v) in enumerate(values))
+    return (ts, (tsf, freq, noise, rssi, pwr))
+
+
+def ht20_packet(rnd, freq=2412, sdata=None):
+    sdata = sdata if sdata is not None else bytes(rnd.randint(0, 255) for _ in range(56))
+    body = struct.pack(">BHbbHBBQ", rnd.randint(0, 3), freq, rnd.randint(-10, 60), rnd.randint(-110, -80),
+                       0, 0, 0, rnd.getrandbits(48)) + sdata
+    return struct.pack(">BH", 1, len(body)) + body
+
+
+def ht40_packet(rnd, freq=2437, chantype=None, sdata=None):
+    chantype = chantype if chantype is not None else rnd.choice((2, 3))
+    sdata = sdata if sdata is not None else bytes(rnd.randint(0, 255) for _ in range(128))
+    body = struct.pack(">BHbbQbbHHbbbbB", chantype, freq, rnd.randint(-10, 60), rnd.randint(-10, 60),
+                       rnd.getrandbits(48), rnd.randint(-110, -80), rnd.randint(-110, -80), 0, 0, 0, 0, 0, 0,
+                       rnd.randint(0, 3)) + sdata
+    return struct.pack(">BH", 2, len(body)) + body
+
+
+def type3_packet(rnd):
+    body = bytes(rnd.randint(0, 255) for _ in range(26 + 64))
+    return struct.pack(">BH", 3, len(body)) + body
+
+
+@pytest.fixture
+def records():
+    return read_records(dump_file)
+
+
+@pytest.fixture
+def golden():
+    with open(golden_file) as f:
+        return [row[1:] for row in csv.reader(f)]
+
+
+@pytest.fixture
+def rnd():
+    return random.Random(4711)  # seeded: failures are reproducible
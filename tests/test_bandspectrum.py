@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+""" BandSpectrum: overlapping channels in the modes max, mean and latest. """
+
+import math
+import pytest
+from conftest import spectrum_sample
+from athspectralscan import BandSpectrum
+
+
+@pytest.mark.parametrize("overlap,ch1_only,both,ch3_only", [("max", -50, -50, -70), ("mean", -55, -60, -70),
+                                                             ("latest", -60, -60, -70)])
+def test_overlap(overlap, ch1_only, both, ch3_only):
+    # channel 1 (2412 MHz) and 3 (2422 MHz) overlap at 24 sub-carriers
+    band = BandSpectrum(band="2.4", overlap=overlap)
+    band.add_samples([spectrum_sample(1.0, 0, [-50] * 56, freq=2412), spectrum_sample(2.0, 1, [-70] * 56, freq=2422),
+                      spectrum_sample(3.0, 2, [-60] * 56, freq=2412)])
+    assert band.sample_count == 3 and band.ts == 3.0
+    freqs = band.get_frequencies()
+    first = freqs.index(2412 - 8.75)
+    assert freqs[first + 32] == 2422 - 8.75
+    spectrum = band.get_spectrum()
+    assert spectrum[first:first + 32] == pytest.approx([ch1_only] * 32)
+    assert spectrum[first + 32:first + 56] == pytest.approx([both] * 24)
+    assert spectrum[first + 56:first + 88] == pytest.approx([ch3_only] * 32)
+    counts = band.get_counts()
+    assert counts[first:first + 88] == [2] * 32 + [3] * 24 + [1] * 32
+    assert sum(counts) == 2 * 56 + 56
+    assert all(math.isnan(v) for v in spectrum[:first] + spectrum[first + 88:])  # no data
+    band.reset()
+    assert sum(band.get_counts()) == 0 and all(math.isnan(v) for v in band.get_spectrum())
+
+
+def test_outside_of_the_band():
+    band = BandSpectrum(band=(2400.125, 2410.125))
+    band.add(spectrum_sample(1.0, 0, list(range(-100, -44)), freq=2412))
+    assert band.get_frequencies()[-1] == 2410.125
+    # the sub-carriers 2403.25 .. 2410.125 (23 of 56) are in the band
+    assert band.get_spectrum()[10:] == list(range(-100, -77))
+    band.add(spectrum_sample(2.0, 1, [-50] * 56, freq=5180))
+    assert sum(band.get_counts()) == 23
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+""" DataHub round trips: live data of a fake debugfs directory -> dump file -> replay, and dump file copies. """
+
+import os
+import json
+import time
+import queue
+import multiprocessing as mp
+import pytest
+from conftest import dump_file, read_records, ht20_packet, ht40_packet, type3_packet
+from athspectralscan import AthSpectralScanDecoder, DataHub, DumpFileSink
+
+
+class FakeScanner(object):
+
+    """ Stands in for AthSpectralScanner: a debugfs directory with a spectral_scan0 file, fed by the test. """
+
+    def __init__(self, debugfs_dir):
+        self.debugfs_dir = debugfs_dir
+        self.config = {"spectral_count": "8", "spectral_period": "18", "spectral_fft_period": "2",
+                       "spectral_short_repeat": "1", "spectral_scan_ctl": "background"}
+        for (fn, value) in self.config.items():
+            with open(os.path.join(debugfs_dir, fn), "w") as f:
+                f.write(value + "\n")
+        self.data_file = open(self.get_data_filename(), "ab", buffering=0)
+
+    def get_data_filename(self):
+        return os.path.join(self.debugfs_dir, "spectral_scan0")
+
+    def get_config(self):
+        cfg = dict(self.config)
+        cfg["driver"] = "fake"
+        cfg["frequency"] = 2412
+        return cfg
+
+    def write(self, data):
+        self.data_file.write(data)
+
+    def close(self):
+        self.data_file.close()
+
+
+def inline_decoder():
+    decoder = AthSpectralScanDecoder()
+    decoder.set_backend("inline")
+    decoder.set_output_queue(queue.Queue())
+    decoder.set_end_of_stream_marker(True)
+    decoder.start()
+    return decoder
+
+
+def drain(decoder):
+    samples = []
+    while True:
+        sample = decoder.output_queue.get(timeout=10)
+        if sample is AthSpectralScanDecoder.end_of_stream_marker:
+            return samples
+        samples.append(sample)
+
+
+def wait_for(condition, timeout=10):
+    end = time.time() + timeout
+    while not condition():
+        if time.time() > end:
+            raise Exception("timeout")
+        time.sleep(0.05)
+
+
+def test_live_round_trip(tmp_path, rnd):
+    debugfs_dir = tmp_path / "debugfs"
+    debugfs_dir.mkdir()
+    scanner = FakeScanner(str(debugfs_dir))
+    scanner.write(ht20_packet(rnd))  # old data, flushed on start
+    dump_out = str(tmp_path / "live.bin")
+    hub = DataHub(scanner=scanner, dump_file_out=dump_out)
+    hub.start()
+    chunks = []
+    for _ in range(5):
+        chunk = b"".join(rnd.choice((ht20_packet, ht40_packet))(rnd) for _ in range(rnd.randint(1, 20)))
+        chunks.append(chunk)
+        offset = hub.dump_file_in_handle.tell()
+        scanner.write(chunk)
+        wait_for(lambda: hub.dump_file_in_handle.tell() >= offset + len(chunk))  # read as one chunk
+    hub.stop()
+    scanner.close()
+
+    records = read_records(dump_out)
+    assert [data for (ts, data) in records] == chunks
+    assert all(abs(ts - time.time()) < 60 for (ts, data) in records)
+    assert [ts for (ts, data) in records] == sorted(ts for (ts, data) in records)
+    with open(dump_out + ".json") as f:
+        meta = json.load(f)
+    assert meta["driver"] == "fake"
+    assert meta["spectral_count"] == "8"
+    assert "start_time" in meta and "end_time" in meta
+
+    # replay the recorded dump: the same samples as decoding the chunks directly
+    decoder = inline_decoder()
+    hub = DataHub(dump_file_in=dump_out, decoder=decoder)
+    hub.start()
+    samples = drain(decoder)
+    hub.stop()
+    expected = [sample for record in records for sample in AthSpectralScanDecoder._decode(record)]
+    assert len(expected) > 0
+    assert samples == expected
+
+
+@pytest.mark.parametrize("fsync_policy", ["none", "chunk", "interval"])
+def test_replay_copy(tmp_path, fsync_policy):
+    dump_out = str(tmp_path / "copy.bin")
+    hub = DataHub(dump_file_in=dump_file, dump_file_out=dump_out, fsync_policy=fsync_policy)
+    hub.start()
+    hub.reader_thread.join()
+    hub.stop()
+    with open(dump_file, "rb") as f1, open(dump_out, "rb") as f2:
+        assert f1.read() == f2.read()
+    assert not os.path.exists(dump_out + ".json")  # meta data is written for live data only
+
+
+def test_replay_small_reads(tmp_path, monkeypatch, rnd):
+    # records split over several reads, incomplete record at the end is dropped
+    dump = str(tmp_path / "many.bin")
+    sink = DumpFileSink(dump)
+    chunks = [b"".join(ht20_packet(rnd) for _ in range(rnd.randint(1, 5))) for _ in range(20)]
+    for (n, chunk) in enumerate(chunks):
+        sink.write_chunk(1000.0 + n, chunk)
+    sink.close()
+    with open(dump, "ab") as f:
+        f.write(DataHub.pack_record_header(2000.0, 500) + bytes(100))  # truncated record
+    monkeypatch.setattr(DataHub, "chunk_size", 100)
+    copy = str(tmp_path / "copy.bin")
+    decoder = inline_decoder()
+    hub = DataHub(dump_file_in=dump, dump_file_out=copy, decoder=decoder)
+    hub.start()
+    samples = drain(decoder)
+    hub.stop()
+    records = read_records(copy)
+    assert [data for (ts, data) in records] == chunks
+    assert [ts for (ts, data) in records] == [1000.0 + n for n in range(len(chunks))]
+    assert samples == [sample for record in records for sample in AthSpectralScanDecoder._decode(record)]
+
+
+def test_sinks(tmp_path):
+    class ListSink(object):
+        def __init__(self):
+            self.chunks = []
+
+        def write_chunk(self, ts, data, header=None):
+            self.chunks.append((ts, data, header))
+
+    sinks = [ListSink(), ListSink()]
+    hub = DataHub(dump_file_in=dump_file, sinks=sinks[0:1])
+    hub.add_sink(sinks[1])
+    hub.start()
+    hub.reader_thread.join()
+    hub.stop()
+    records = read_records(dump_file)
+    for sink in sinks:
+        assert [(ts, data) for (ts, data, header) in sink.chunks] == records
+        assert all(header == DataHub.pack_record_header(ts, len(data)) for (ts, data, header) in sink.chunks)
+    assert sinks[0].chunks[0][1] is sinks[1].chunks[0][1]  # shared, not copied
+
+
+def test_invalid_input():
+    with pytest.raises(Exception):
+        DataHub()
+    with pytest.raises(Exception):
+        DataHub(scanner=object(), dump_file_in=dump_file)
+    with pytest.raises(Exception):
+        DataHub(dump_file_in="/nonexistent/dump.bin")
+
+
+@pytest.mark.parametrize("backend", ["process", "thread", "inline"])
+def test_undecodable_chunks_are_skipped(tmp_path, rnd, backend):
+    # a type-3 (ath10k) packet or an unknown chantype ends the decoding of its chunk, not the decoding at all
+    good = [b"".join(ht20_packet(rnd, sdata=bytes([1] * 56)) for _ in range(3)) for _ in range(4)]
+    bad = [type3_packet(rnd), ht20_packet(rnd, sdata=bytes([2] * 56)) + ht40_packet(rnd, chantype=1)]
+    chunks = [good[0], bad[0], good[1], bad[1], good[2], good[3]]
+    dump = str(tmp_path / "bad.bin")
+    sink = DumpFileSink(dump)
+    for (n, chunk) in enumerate(chunks):
+        sink.write_chunk(float(n), chunk)
+    sink.close()
+    decoder = AthSpectralScanDecoder()
+    decoder.set_backend(backend)
+    decoder.set_output_queue(mp.Queue() if backend == "process" else queue.Queue())
+    decoder.set_end_of_stream_marker(True)
+    decoder.start()
+    hub = DataHub(dump_file_in=dump, decoder=decoder)
+    hub.start()
+    samples = drain(decoder)
+    hub.stop()
+    assert decoder.join(timeout=10)
+    assert len(samples) == 4 * 3 + 1  # the HT20 sample before the unknown chantype is kept
+    assert sorted(sample[0] for sample in samples) == [0.0] * 3 + [2.0] * 3 + [3.0] + [4.0] * 3 + [5.0] * 3
+
+
+def test_end_of_stream_on_error(tmp_path):
+    # the reader thread dies (here: a failing sink), the decoder still gets the end of the stream
+    class FailingSink(object):
+        def write_chunk(self, ts, data, header=None):
+            raise IOError("disk full")
+
+    decoder = inline_decoder()
+    hub = DataHub(dump_file_in=dump_file, decoder=decoder, sinks=[FailingSink()])
+    hub.start()
+    hub.reader_thread.join()
+    assert decoder.join(timeout=10)
+    assert drain(decoder) == []
+    hub.stop()
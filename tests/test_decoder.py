@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+""" Golden-output tests: every decoder mode and backend against examples/dump.bin -> examples/dump.csv. """
+
+import math
+import queue
+import os
+import time
+import shutil
+import threading
+import multiprocessing as mp
+import pytest
+from conftest import dump_file, to_row, ht20_packet, ht40_packet
+from athspectralscan import athspectralscandecoder
+from athspectralscan import AthSpectralScanDecoder, DataHub, DumpFileSink, DecodeProjection, DecodeCache, LoadController
+from athspectralscan import InterferenceDetector, query
+
+
+def decode(records, **kwargs):
+    return [sample for record in records for sample in AthSpectralScanDecoder._decode(record, **kwargs)]
+
+
+def test_golden(records, golden):
+    assert len(golden) == 243
+    assert [to_row(sample) for sample in decode(records)] == golden
+
+
+def test_golden_no_pwr(records, golden):
+    samples = decode(records, no_pwr=True)
+    assert [to_row(sample) for sample in samples] == [row[0:4] for row in golden]
+    assert all(sample[1][4] == dict() for sample in samples)
+
+
+def test_golden_full_fidelity(records):
+    assert decode(records, fidelity="full") == decode(records)
+
+
+def test_golden_metadata_fidelity(records):
+    assert decode(records, fidelity="metadata") == decode(records, no_pwr=True)
+
+
+def test_golden_decimated_fidelity(records):
+    for (full, decimated) in zip(decode(records), decode(records, fidelity="decimated", decimation=4)):
+        assert full[1][0:4] == decimated[1][0:4]
+        freqs = list(full[1][4].keys())
+        values = list(full[1][4].values())
+        assert list(decimated[1][4].keys()) == freqs[::4]
+        for n, value in enumerate(decimated[1][4].values()):
+            # mean of the linear power of the full-fidelity bins of the group
+            group = values[4 * n:4 * n + 4]
+            expected = 10 * math.log10(sum(10 ** (v / 10) for v in group) / len(group))
+            assert value == pytest.approx(expected, abs=1e-6)
+
+
+def test_golden_peak_fidelity(records, golden):
+    for (row, peak) in zip(golden, decode(records, fidelity="peak")):
+        assert to_row(peak)[0:4] == row[0:4]
+        assert len(peak[1][4]) == 1
+        assert "%.2f" % list(peak[1][4].values())[0] == max(row[4:], key=float)
+
+
+def test_golden_projection(records, golden):
+    assert decode(records, projection=DecodeProjection()) == decode(records)
+    samples = decode(records, projection=DecodeProjection(fields=("tsf", "rssi", "pwr"), bins=(10, 20), freq=2412))
+    assert len(samples) == len(golden)
+    for (row, (ts, (tsf, rssi, pwr))) in zip(golden, samples):
+        assert [str(tsf), str(rssi)] == [row[0], row[3]]
+        assert ["%.2f" % p for p in pwr.values()] == row[4 + 10:4 + 20]
+    assert decode(records, projection=DecodeProjection(freq=2437)) == []
+
+
+@pytest.mark.parametrize("backend,processes,start_method", [("process", 1, None), ("process", 2, None),
+                                                             ("process", 2, "spawn"), ("thread", 2, None),
+                                                             ("inline", 1, None)])
+def test_golden_backends(golden, monkeypatch, backend, processes, start_method):
+    context = mp
+    if start_method is not None:
+        # the default on macOS and Python >= 3.14: the decoder is pickled for each worker
+        context = mp.get_context(start_method)
+        monkeypatch.setattr(athspectralscandecoder, "mp", context)
+    decoder = AthSpectralScanDecoder()
+    decoder.set_backend(backend)
+    decoder.set_number_of_processes(processes)
+    output_queue = context.Queue() if backend == "process" else queue.Queue()
+    decoder.set_output_queue(output_queue)
+    decoder.set_end_of_stream_marker(True)
+    decoder.start()
+    hub = DataHub(dump_file_in=dump_file, decoder=decoder)
+    hub.start()
+    samples = []
+    while True:
+        sample = output_queue.get(timeout=30)
+        if sample is AthSpectralScanDecoder.end_of_stream_marker:
+            break
+        samples.append(sample)
+    hub.stop()
+    decoder.join()
+    assert decoder.is_finished()
+    rows = [to_row(sample) for sample in sorted(samples, key=lambda s: s[1][0])]  # several workers: sort by TSF
+    assert rows == golden
+
+
+def test_golden_load_controller(golden):
+    decoder = AthSpectralScanDecoder()
+    decoder.set_backend("inline")
+    output_queue = queue.Queue()
+    decoder.set_output_queue(output_queue)
+    decoder.set_load_controller(LoadController())
+    decoder.start()
+    hub = DataHub(dump_file_in=dump_file, decoder=decoder)
+    hub.start()
+    hub.reader_thread.join()
+    hub.stop()
+    samples = [output_queue.get_nowait() for _ in range(output_queue.qsize())]
+    assert all(sample[2] == "full" for sample in samples)  # no load: full fidelity
+    assert [to_row(sample) for sample in samples] == golden
+
+
+def test_golden_decode_cache(tmp_path, golden):
+    dump_copy = str(tmp_path / "dump.bin")
+    shutil.copy(dump_file, dump_copy)
+    cache = DecodeCache(str(tmp_path / "cache"))
+    for _ in range(2):  # miss, hit
+        with cache.decode(dump_copy) as spectra:
+            assert len(spectra) == len(golden)
+            for (row, sample) in zip(golden, spectra):
+                assert to_row(sample)[0:4] == row[0:4]
+                # float32 values
+                assert list(sample[1][4].values()) == pytest.approx([float(v) for v in row[4:]], abs=0.006)
+    assert sorted(os.listdir(str(tmp_path))) == ["cache", "dump.bin"]  # no index file next to the dump
+
+
+def test_golden_query(tmp_path, golden):
+    dump_copy = str(tmp_path / "dump.bin")  # the index is written next to the dump
+    shutil.copy(dump_file, dump_copy)
+    assert [to_row(sample) for sample in query(dump_copy, None, None)] == golden
+    assert [to_row(sample) for sample in query(dump_copy, None, None, processes=2, min_bytes_per_process=1)] == golden
+    assert query(dump_copy, None, None, freq=5180) == []
+
+
+def test_stop_does_not_block_on_unread_output(records):
+    for drain in (True, False):
+        decoder = AthSpectralScanDecoder()
+        output_queue = mp.Queue()
+        decoder.set_output_queue(output_queue)
+        decoder.start()
+        for record in records * 4:
+            decoder.enqueue(record)
+        time.sleep(0.5)  # let the worker fill the output pipe
+        t_start = time.time()
+        finished = decoder.stop(drain=drain, timeout=1)
+        assert time.time() - t_start < 3
+        if drain:
+            assert not finished  # the worker waits for its output to be read
+            samples = [output_queue.get(timeout=10) for _ in range(4 * 243)]
+            assert [to_row(sample) for sample in samples[0:243]] == [to_row(sample) for sample in decode(records)]
+            assert decoder.join(timeout=10)
+        else:
+            assert finished
+
+
+
+def test_stop_without_drain(records, monkeypatch):
+    errors = []
+    monkeypatch.setattr(athspectralscandecoder.logger, "error", lambda *args: errors.append(args))
+    for read_output in (True, False):
+        decoder = AthSpectralScanDecoder()
+        decoder.set_number_of_processes(2)
+        output_queue = mp.Queue()
+        decoder.set_output_queue(output_queue)
+        decoder.start()
+        workers = list(decoder.workers)
+        reader = threading.Thread(target=lambda: list(iter(lambda: output_queue.get(timeout=10), None)))
+        if read_output:
+            reader.start()
+        for record in records * 4:
+            decoder.enqueue(record)
+        assert decoder.stop(drain=False, timeout=1)
+        if read_output:
+            # the workers skip the enqueued data and exit by themselves
+            assert [worker.exitcode for worker in workers] == [0, 0]
+            output_queue.put(None)
+            reader.join()
+    assert errors == []  # a requested termination is no error
+
+@pytest.mark.parametrize("no_pwr", [False, True])
+def test_decode_cache_ht40(tmp_path, rnd, no_pwr):
+    # HT40 noise / rssi are averages (x.5), also without pwr values
+    data = b"".join(ht40_packet(rnd) for _ in range(50)) + b"".join(ht20_packet(rnd) for _ in range(10))
+    dump = str(tmp_path / "ht40.bin")
+    sink = DumpFileSink(dump)
+    sink.write_chunk(1.0, data)
+    sink.close()
+    samples = list(AthSpectralScanDecoder._decode((1.0, data), no_pwr=no_pwr))
+    assert any(sample[1][2] % 1 for sample in samples)
+    cache = DecodeCache(str(tmp_path / "cache"))
+    with cache.decode(dump, no_pwr=no_pwr) as spectra:
+        for (sample, cached) in zip(samples, spectra):
+            assert cached[1][0:4] == sample[1][0:4]
+            assert [type(v) for v in cached[1][2:4]] == [type(v) for v in sample[1][2:4]]
+            assert list(cached[1][4].values()) == pytest.approx(list(sample[1][4].values()), abs=1e-4)
+        assert len(spectra) == len(samples)
+
+
+def test_decode_cache_old_entry(tmp_path, golden):
+    dump_copy = str(tmp_path / "dump.bin")
+    shutil.copy(dump_file, dump_copy)
+    cache = DecodeCache(str(tmp_path / "cache"))
+    cache.decode(dump_copy).close()
+    (entry,) = [fn for fn in os.listdir(str(tmp_path / "cache")) if fn.endswith(DecodeCache.suffix)]
+    with open(str(tmp_path / "cache" / entry), "r+b") as f:
+        f.write(b"ASC1")  # entry of the previous file format
+    with cache.decode(dump_copy) as spectra:
+        assert [to_row(sample)[0:4] for sample in spectra] == [row[0:4] for row in golden]
+
+
+def test_projection_can_not_be_combined():
+    for (setter, value) in (("set_detector", InterferenceDetector()), ("set_load_controller", LoadController())):
+        decoder = AthSpectralScanDecoder()
+        decoder.set_backend("inline")
+        decoder.set_output_queue(queue.Queue())
+        decoder.set_projection(DecodeProjection(fields=("tsf", "pwr")))
+        getattr(decoder, setter)(value)
+        with pytest.raises(Exception, match="projection"):
+            decoder.start()
+        assert not decoder.running
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+""" Property tests of AthSpectralScanDecoder._decode() on random, truncated and malformed input (seeded, so a
+failure is reproducible). """
+
+import math
+import pytest
+from conftest import ht20_packet, ht40_packet, type3_packet
+from athspectralscan import AthSpectralScanDecoder, DecodeProjection, StageTimers
+
+fidelities = (None, "decimated", "peak", "metadata")
+
+
+def decode(data, **kwargs):
+    return list(AthSpectralScanDecoder._decode((0.0, data), **kwargs))
+
+
+def check_sample(sample, nbins):
+    (ts, (tsf, freq, noise, rssi, pwr)) = sample
+    assert len(pwr) == nbins
+    freqs = list(pwr.keys())
+    assert freqs[0] == freq - nbins / 2 * 0.3125
+    assert all(f == pytest.approx(freqs[0] + i * 0.3125) for i, f in enumerate(freqs))
+    assert all(math.isfinite(v) for v in pwr.values())
+
+
+def test_random_ht20(rnd):
+    for _ in range(200):
+        sample = decode(ht20_packet(rnd, freq=rnd.choice((2412, 2437, 5180))))
+        if sample:  # dropped, if all bins are zero
+            check_sample(sample[0], 56)
+
+
+def test_random_ht40(rnd):
+    for _ in range(200):
+        chantype = rnd.choice((2, 3))
+        sample = decode(ht40_packet(rnd, freq=2437, chantype=chantype))
+        if sample:
+            check_sample(sample[0], 128)
+            assert sample[0][1][1] == (2427 if chantype == 2 else 2447)  # center of the HT40 channel
+
+
+def test_all_zero_bins_are_dropped(rnd):
+    assert decode(ht20_packet(rnd, sdata=bytes(56))) == []
+    assert decode(ht40_packet(rnd, sdata=bytes(128))) == []
+    assert decode(ht40_packet(rnd, sdata=bytes(64) + bytes([1] * 64))) == []  # one half is zero
+
+
+def test_zero_bins_are_replaced(rnd):
+    for _ in range(50):
+        sdata = bytes(rnd.choice((0, rnd.randint(1, 255))) for _ in range(56))
+        for sample in decode(ht20_packet(rnd, sdata=sdata)):
+            check_sample(sample, 56)
+
+
+def test_unknown_chantype(rnd):
+    with pytest.raises(Exception, match="chantype"):
+        decode(ht40_packet(rnd, chantype=1))
+
+
+def test_type3_is_not_supported(rnd):
+    with pytest.raises(Exception, match="ath10k"):
+        decode(type3_packet(rnd))
+    # the samples before the ath10k packet are decoded
+    packets = ht20_packet(rnd, sdata=bytes([1] * 56)) + type3_packet(rnd)
+    generator = AthSpectralScanDecoder._decode((0.0, packets))
+    assert len(next(generator)[1][4]) == 56
+    with pytest.raises(Exception, match="ath10k"):
+        next(generator)
+
+
+@pytest.mark.parametrize("fidelity", fidelities)
+def test_truncated(rnd, fidelity):
+    # a cut anywhere yields the samples of the complete packets, the incomplete one is skipped
+    packets = [rnd.choice((ht20_packet, ht40_packet))(rnd) for _ in range(20)]
+    data = b"".join(packets)
+    full = decode(data, fidelity=fidelity)
+    for _ in range(200):
+        cut = rnd.randint(0, len(data))
+        samples = decode(data[:cut], fidelity=fidelity)
+        assert samples == full[:len(samples)]
+        end = 0
+        n_complete = 0
+        for packet in packets:
+            end += len(packet)
+            if end > cut:
+                break
+            n_complete += 1
+        assert samples == decode(b"".join(packets[:n_complete]), fidelity=fidelity)
+
+
+@pytest.mark.parametrize("fidelity", fidelities)
+def test_malformed_header(rnd, fidelity):
+    # a malformed header ends the decoding of the chunk, the samples before it are kept
+    packets = [rnd.choice((ht20_packet, ht40_packet))(rnd) for _ in range(10)]
+    for _ in range(100):
+        n = rnd.randint(0, len(packets))
+        stype = rnd.choice((1, 2, 3, 4, 255))
+        slen = rnd.randint(0, 300)
+        if (stype, slen) in ((1, 73), (2, 152), (3, 90)):
+            continue  # valid
+        garbage = bytes([stype, slen >> 8, slen & 0xff]) + bytes(rnd.randint(0, 255) for _ in range(100))
+        data = b"".join(packets[:n]) + garbage + b"".join(packets[n:])
+        assert decode(data, fidelity=fidelity) == decode(b"".join(packets[:n]), fidelity=fidelity)
+
+
+def test_ht40_max_exp_is_unsigned(rnd):
+    # max_exp is an u8 in the kernel struct, values >= 128 raised "negative shift count"
+    packet = bytearray(ht40_packet(rnd, chantype=2, sdata=bytes([1] * 128)))
+    packet[3 + 23] = 200  # max_exp: last byte of the header
+    for projection in (None, DecodeProjection()):
+        samples = decode(bytes(packet), projection=projection)
+        assert len(samples) == 1
+        check_sample(samples[0], 128)
+
+
+def test_random_bytes(rnd):
+    # arbitrary input: either decoded (maybe partly) or one of the known exceptions, never anything else
+    for _ in range(500):
+        data = bytes(rnd.randint(0, 255) for _ in range(rnd.randint(0, 400)))
+        if rnd.random() < 0.5:  # make valid headers likely
+            (stype, slen) = rnd.choice(((1, 73), (2, 152)))
+            data = bytes([stype, 0, slen]) + data
+        try:
+            decode(data)
+            decode(data, no_pwr=True)
+            decode(data, projection=DecodeProjection(bins=(0, 10)))
+        except Exception as e:
+            assert "chantype" in str(e) or "ath10k" in str(e)
+
+
+def test_decimated_zero_bins(rnd):
+    # zero bins count as in full decoding (replaced by the mean), a group is the mean of the full-fidelity bins
+    sdata = bytes([0, 0, 0, 0, 0, 9, 0, 0] + [rnd.randint(1, 255) for _ in range(48)])
+    packet = ht20_packet(rnd, sdata=sdata)
+    (full,) = decode(packet)
+    (decimated,) = decode(packet, fidelity="decimated", decimation=4)
+    values = list(full[1][4].values())
+    for (n, value) in enumerate(decimated[1][4].values()):
+        group = values[4 * n:4 * n + 4]
+        assert value == pytest.approx(10 * math.log10(sum(10 ** (v / 10) for v in group) / 4), abs=1e-9)
+
+
+def test_trailing_bytes(rnd):
+    # less than a header left: ignored
+    data = ht20_packet(rnd, sdata=bytes([1] * 56))
+    for n in range(1, 4):
+        assert decode(data + bytes([1] * n)) == decode(data)
+
+
+def test_projection_is_decode(rnd):
+    # same values as _decode(), also for zero bins and bin ranges across both HT40 halves
+    data = b"".join(ht20_packet(rnd, sdata=bytes(rnd.choice((0, rnd.randint(1, 255))) for _ in range(56))) +
+                    ht40_packet(rnd, sdata=bytes(rnd.choice((0, rnd.randint(1, 255))) for _ in range(128)))
+                    for _ in range(50))
+    for bins in (None, (0, 10), (50, 80), (60, 128)):
+        samples = decode(data, projection=DecodeProjection(bins=bins))
+        full = decode(data)
+        assert len(samples) == len(full)
+        for (sample, expected) in zip(samples, full):
+            assert sample[1][0:4] == expected[1][0:4]
+            bin_range = range(0, len(expected[1][4])) if bins is None else range(*bins)
+            assert list(sample[1][4].items()) == list(expected[1][4].items())[bin_range.start:bin_range.stop]
+
+
+def test_projection_no_pwr(rnd):
+    # the default projection equals _decode(), also the (not shifted) freq of HT40 samples
+    data = b"".join(ht20_packet(rnd) + ht40_packet(rnd) for _ in range(20))
+    assert decode(data, no_pwr=True, projection=DecodeProjection()) == decode(data, no_pwr=True)
+    samples = decode(data, no_pwr=True, projection=DecodeProjection(fields=("tsf", "freq", "noise", "pwr")))
+    assert samples == [(ts, (tsf, freq, noise, pwr))
+                       for (ts, (tsf, freq, noise, rssi, pwr)) in decode(data, no_pwr=True)]
+    assert all(sample[1][3] == dict() for sample in samples)
+    assert set(sample[1][1] for sample in samples) == {2412, 2437}
+
+
+def test_projection_timers(rnd):
+    timers = StageTimers()
+    samples = decode(b"".join(ht20_packet(rnd, sdata=bytes([1] * 56)) for _ in range(10)),
+                     projection=DecodeProjection(fields=("pwr",)), timers=timers)
+    assert len(samples) == 10
+    assert [timers.stages[stage][0] for stage in ("decode;unpack", "decode;pwr", "decode;dict")] == [10, 10, 10]
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+""" DumpIndex and query(): time / frequency ranges of a multi-record, multi-channel dump, stale index files. """
+
+import os
+from conftest import ht20_packet, ht40_packet
+from athspectralscan import AthSpectralScanDecoder, DumpFileSink, DumpIndex, query
+
+channels = (2412, 2437, "ht40")  # record n is on channels[n % 3], the HT40 channel is 2462 MHz HT40- (center 2452)
+
+
+def write_dump(filename, rnd, records=12, t_start=1.0):
+    # record n: ts = t_start + n, 5 samples of one channel. The bins are non-zero, so no sample is dropped
+    sink = DumpFileSink(filename)
+    chunks = []
+    for n in range(records):
+        channel = channels[n % 3]
+        if channel == "ht40":
+            packets = [ht40_packet(rnd, freq=2462, chantype=2, sdata=bytes(rnd.randint(1, 255) for _ in range(128)))
+                       for _ in range(5)]
+        else:
+            packets = [ht20_packet(rnd, freq=channel, sdata=bytes(rnd.randint(1, 255) for _ in range(56)))
+                       for _ in range(5)]
+        data = b"".join(packets)
+        sink.write_chunk(t_start + n, data)
+        chunks.append((t_start + n, data))
+    sink.close()
+    return chunks
+
+
+def decode(chunks):
+    return [sample for chunk in chunks for sample in AthSpectralScanDecoder._decode(chunk)]
+
+
+def test_find(tmp_path, rnd):
+    dump = str(tmp_path / "dump.bin")
+    write_dump(dump, rnd)
+    index = DumpIndex(dump)
+    assert len(index) == 12
+    assert list(index.ts) == [1.0 + n for n in range(12)]
+    assert index.find() == list(range(12))
+    assert index.find(t0=3.0, t1=6.0) == [2, 3, 4, 5]
+    assert index.find(t0=3.5, t1=5.5) == [3, 4]
+    assert index.find(t0=20.0) == []
+    assert index.find(freq=2437) == [1, 4, 7, 10]
+    assert index.find(freq=2452) == [2, 5, 8, 11]  # the decoded center of the HT40 samples
+    assert index.find(t0=1.0, t1=6.0, freq=(2400, 2440)) == [0, 1, 3, 4]
+    assert index.find(freq=5180) == []
+
+
+def test_query(tmp_path, rnd):
+    dump = str(tmp_path / "dump.bin")
+    chunks = write_dump(dump, rnd)
+    assert query(dump, None, None) == decode(chunks)
+    assert query(dump, 3.0, 6.0) == decode(chunks[2:6])
+    assert query(dump, None, None, freq=2437) == decode(chunks[1::3])
+    assert query(dump, None, None, freq=2452) == decode(chunks[2::3])
+    assert query(dump, 2.0, 9.0, freq=(2400, 2440)) == decode([chunks[n] for n in (1, 3, 4, 6, 7)])
+    assert query(dump, 2.0, 9.0, freq=2437, processes=2, min_bytes_per_process=1) == decode(chunks[1:9:3])
+
+
+def test_stale_index(tmp_path, rnd):
+    dump = str(tmp_path / "dump.bin")
+    write_dump(dump, rnd)
+    assert len(DumpIndex(dump)) == 12
+    assert os.path.exists(dump + DumpIndex.suffix)
+    # the dump changes size: rebuilt
+    chunks = write_dump(dump, rnd, records=6)
+    assert len(DumpIndex(dump)) == 6
+    assert query(dump, None, None) == decode(chunks)
+    # same size, only the mtime changes: rebuilt
+    stat = os.stat(dump)
+    chunks = write_dump(dump, rnd, records=6, t_start=100.0)
+    assert os.stat(dump).st_size == stat.st_size
+    os.utime(dump, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    assert list(DumpIndex(dump).ts) == [100.0 + n for n in range(6)]
+    assert query(dump, 100.0, 101.0) == decode(chunks[0:2])
+    # the index of the unchanged dump is used, it is not rebuilt
+    mtime = os.stat(dump + DumpIndex.suffix).st_mtime_ns
+    assert len(DumpIndex(dump)) == 6
+    assert os.stat(dump + DumpIndex.suffix).st_mtime_ns == mtime
+
+
+def test_without_index_file(tmp_path, rnd):
+    dump = str(tmp_path / "dump.bin")
+    write_dump(dump, rnd)
+    assert len(DumpIndex(dump, use_index_file=False)) == 12
+    assert not os.path.exists(dump + DumpIndex.suffix)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+""" InterferenceDetector: start / stop of events with hysteresis. """
+
+import queue
+import multiprocessing as mp
+import pytest
+from conftest import spectrum_sample, ht20_packet, ht40_packet
+from athspectralscan import AthSpectralScanDecoder, InterferenceDetector
+
+
+def run(detector, rssis, freq=2412, noise=-95):
+    # one sample per rssi value, tsf = index. Returns [(index of the sample, event), ...]
+    events = []
+    for (tsf, rssi) in enumerate(rssis):
+        events += [(tsf, event) for event in detector.process((0.0, (tsf, freq, noise, rssi, dict())))]
+    return events
+
+
+def test_hysteresis():
+    detector = InterferenceDetector(threshold_db=10, hysteresis_db=3, min_samples=3, hold_samples=2)
+    # 2 samples above the threshold are not sustained, the event starts at tsf 3. Above the release level (7) it
+    # goes on, it ends after 2 samples below it
+    rssis = [12, 12, 5, 12, 11, 15, 8, 9, 6, 8, 6, 6, 12]
+    assert run(detector, rssis) == [(11, (3, 9, 2412 - 8.75, 2412 + 8.75, -95 + 15))]
+    assert detector.flush() == []  # tsf 12 is not sustained
+
+
+def test_flush_and_channels():
+    detector = InterferenceDetector(threshold_db=10, hysteresis_db=0, min_samples=1, hold_samples=1)
+    assert run(detector, [20, 20], freq=2412) == []
+    assert run(detector, [20, 0], freq=2437) == [(1, (0, 0, 2437 - 8.75, 2437 + 8.75, -75))]
+    assert detector.flush() == [(0, 1, 2412 - 8.75, 2412 + 8.75, -75)]  # still open
+
+
+def test_span_of_pwr():
+    # the span covers the sub-carriers above noise + threshold, the peak is the strongest one
+    detector = InterferenceDetector(threshold_db=10, min_samples=1, hold_samples=1)
+    values = [-100] * 20 + [-80, -70, -80] + [-100] * 33
+    sample = spectrum_sample(0.0, 0, values, noise=-95, rssi=20)
+    assert detector.process(sample) == []
+    freqs = list(sample[1][4].keys())
+    assert detector.flush() == [(0, 0, freqs[20], freqs[22], -70)]
+
+
+def test_span_of_no_pwr(rnd):
+    # without pwr values the span is the channel: 56 bins (HT20) or 128 bins (HT40) around the freq of the sample
+    for (packet, span) in ((ht20_packet(rnd, freq=2412), (2403.25, 2420.75)),
+                           (ht40_packet(rnd, freq=2437), (2417, 2457))):
+        (sample,) = AthSpectralScanDecoder._decode((0.0, packet), no_pwr=True)
+        detector = InterferenceDetector(threshold_db=-1000, min_samples=1)
+        detector.process(sample)
+        ((start_tsf, end_tsf, freq_lo, freq_hi, peak),) = detector.flush()
+        assert (freq_lo, freq_hi) == span
+
+
+@pytest.mark.parametrize("backend", ["inline", "thread", "process"])
+def test_alarm_only(records, backend):
+    # a detector with an event queue, no output queue: only the events are delivered
+    decoder = AthSpectralScanDecoder()
+    decoder.set_backend(backend)
+    event_queue = mp.Queue() if backend == "process" else queue.Queue()
+    decoder.set_event_queue(event_queue)
+    decoder.set_detector(InterferenceDetector(threshold_db=0, min_samples=1))
+    decoder.start()
+    for record in records:
+        decoder.enqueue(record)
+    assert decoder.stop(timeout=10)
+    (start_tsf, end_tsf, freq_lo, freq_hi, peak) = event_queue.get(timeout=10)  # closed by the flush on stop
+    assert (freq_lo, freq_hi) == (2412 - 8.75, 2412 + 8.75 - 0.3125)  # the golden samples are on channel 1
+    assert start_tsf < end_tsf
+    with pytest.raises(queue.Empty):
+        event_queue.get(timeout=0.5)
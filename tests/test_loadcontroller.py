@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+""" LoadController: steps down under pressure (queue depth, lag), rate limit, recovery and the lowest fidelity. """
+
+import datetime
+import pytest
+from athspectralscan import LoadController
+
+
+def live_ts(age_sec):
+    # time stamp of a live chunk, age_sec old
+    return datetime.datetime.now() - datetime.timedelta(seconds=age_sec)
+
+
+def test_queue_depth():
+    controller = LoadController(high_water=100, step_interval_sec=1.0)
+    assert controller.update(100, now=0.0) == "full"  # at the limit
+    assert controller.update(101, now=0.0) == "decimated"
+    assert controller.update(500, now=0.5) == "decimated"  # one step per step_interval_sec
+    assert controller.update(500, now=1.0) == "peak"
+    assert controller.update(500, now=2.0) == "metadata"
+    assert controller.update(500, now=3.0) == "metadata"  # the cheapest one
+    assert controller.get_fidelity() == "metadata"
+    assert controller.steps == 3
+
+
+def test_lag():
+    controller = LoadController(max_lag_sec=2.0)
+    assert controller.update(0, ts=live_ts(1.5), now=0.0) == "full"
+    assert controller.update(0, ts=live_ts(5.0), now=0.0) == "decimated"
+    # recorded data (float time stamps) has no lag
+    controller = LoadController(max_lag_sec=2.0)
+    assert controller.update(0, ts=0.0, now=0.0) == "full"
+
+
+def test_recover():
+    controller = LoadController(high_water=100, low_water=20, max_lag_sec=2.0, step_interval_sec=0.0,
+                                recover_sec=5.0)
+    for now in (0.0, 1.0):
+        controller.update(200, now=now)
+    assert controller.get_fidelity() == "peak"
+    assert controller.update(10, now=2.0) == "peak"  # relaxed since 2.0
+    assert controller.update(10, now=6.9) == "peak"
+    assert controller.update(10, now=7.0) == "decimated"  # one step per recover_sec
+    assert controller.update(50, now=8.0) == "decimated"  # between the limits: the period without pressure restarts
+    assert controller.update(10, now=9.0) == "decimated"
+    assert controller.update(10, now=13.9) == "decimated"
+    assert controller.update(10, now=14.0) == "full"
+    # a lag above max_lag_sec / 2 is no relaxation either
+    controller.update(200, now=15.0)
+    for now in (16.0, 30.0):
+        assert controller.update(10, ts=live_ts(1.5), now=now) == "decimated"
+    assert controller.update(10, ts=live_ts(0.5), now=31.0) == "decimated"
+    assert controller.update(10, ts=live_ts(0.5), now=36.0) == "full"
+
+
+def test_min_fidelity():
+    controller = LoadController(high_water=10, step_interval_sec=0.0, min_fidelity="peak")
+    for now in range(10):
+        controller.update(100, now=float(now))
+    assert controller.get_fidelity() == "peak"
+    controller = LoadController(min_fidelity="full")
+    assert controller.update(1000, now=0.0) == "full"
+    with pytest.raises(Exception, match="fidelity"):
+        LoadController(min_fidelity="none")
+    with pytest.raises(Exception, match="decimation"):
+        LoadController(decimation=0)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+""" Profiler: merged stage timers and collapsed stacks of a profiled decoder run. """
+
+import queue
+import threading
+from conftest import dump_file
+from athspectralscan import AthSpectralScanDecoder, DataHub, Profiler
+
+
+def read_collapsed(filename):
+    with open(filename) as f:
+        return dict(line.rsplit(" ", 1) for line in f.read().splitlines())
+
+
+def test_collapsed(tmp_path):
+    profiler = Profiler(str(tmp_path / "profile"))
+    barrier = threading.Barrier(2)  # both workers run at the same time: one file each
+
+    def worker(seconds):
+        session = profiler.session("decoder")
+        session.timers.add("decode;pwr", seconds, 10)
+        barrier.wait()
+        session.stop()
+    threads = [threading.Thread(target=worker, args=(seconds,)) for seconds in (0.5, 0.25)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    session = profiler.session("hub")
+    session.timers.add("read", 0.001)
+    session.stop()
+    assert profiler.get_timers() == {"decoder;decode;pwr": [20, 0.75], "hub;read": [1, 0.001]}
+    profiler.write_collapsed(str(tmp_path / "collapsed.txt"))
+    assert read_collapsed(str(tmp_path / "collapsed.txt")) == {"stages;decoder;decode;pwr": "750000",
+                                                               "stages;hub;read": "1000"}
+    profiler.clear()
+    assert profiler.get_timers() == {}
+
+
+def test_golden_profiled(tmp_path):
+    profiler = Profiler(str(tmp_path / "profile"), cprofile=True)
+    decoder = AthSpectralScanDecoder()
+    decoder.set_backend("inline")
+    decoder.set_output_queue(queue.Queue())
+    decoder.set_profiler(profiler)
+    decoder.start()
+    hub = DataHub(dump_file_in=dump_file, decoder=decoder)
+    hub.set_profiler(profiler)
+    hub.start()
+    hub.reader_thread.join()
+    hub.stop()
+    decoder.stop()
+    timers = profiler.get_timers()
+    assert timers["decoder;decode;pwr"][0] == 243
+    assert timers["hub;read"][0] >= 1
+    profiler.write_collapsed(str(tmp_path / "collapsed.txt"))
+    stacks = read_collapsed(str(tmp_path / "collapsed.txt"))
+    assert "stages;decoder;decode;pwr" in stacks
+    assert any(stack.endswith("athspectralscandecoder.py:_decode") for stack in stacks)  # cProfile data
+    assert all(int(us) >= 0 for us in stacks.values())
+    assert "decoder;decode;pwr" in profiler.report()
+
+
+def test_inline_session_in_the_decoding_thread(tmp_path):
+    # the inline decoder runs in the reader thread of DataHub: its session (and cProfile) has to be started there
+    profiler = Profiler(str(tmp_path / "profile"), cprofile=True)
+    decoder = AthSpectralScanDecoder()
+    decoder.set_backend("inline")
+    decoder.set_output_queue(queue.Queue())
+    decoder.set_profiler(profiler)
+    decoder.start()
+    hub = DataHub(dump_file_in=dump_file, decoder=decoder)  # the hub is not profiled
+    hub.start()
+    reader_thread = hub.reader_thread
+    reader_thread.join()
+    hub.stop()
+    decoder.stop()
+    (timers_file,) = profiler._files(Profiler.timers_suffix)
+    assert timers_file.endswith("-%d%s" % (reader_thread.ident, Profiler.timers_suffix))
+    profiler.write_collapsed(str(tmp_path / "collapsed.txt"))
+    stacks = read_collapsed(str(tmp_path / "collapsed.txt"))
+    assert any(stack.endswith("athspectralscandecoder.py:_decode") for stack in stacks)
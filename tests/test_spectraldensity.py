@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+""" SpectralDensity: histogram of the golden samples, merge and serialization round trip. """
+
+import pytest
+from conftest import spectrum_sample
+from athspectralscan import AthSpectralScanDecoder, SpectralDensity
+
+
+def test_golden_merge_round_trip(records):
+    samples = [sample for record in records for sample in AthSpectralScanDecoder._decode(record)]
+    whole = SpectralDensity()
+    whole.add_samples(samples)
+    assert whole.sample_count == len(samples)
+    assert whole.get_frequencies() == list(samples[0][1][4].keys())  # 2.4 GHz: 0.125 MHz off the global grid
+    assert all(sum(row) == len(samples) for row in whole.get_density().values())  # one count per sample and bin
+
+    # e.g. two worker processes: each one histograms a part, the parts are serialized and merged
+    (first, second) = (SpectralDensity(), SpectralDensity())
+    first.add_samples(samples[:100])
+    second.add_samples(samples[100:])
+    merged = SpectralDensity.from_bytes(first.to_bytes())
+    merged.merge(SpectralDensity.from_bytes(second.to_bytes()))
+    assert merged.sample_count == whole.sample_count
+    assert merged.get_density() == whole.get_density()
+    assert merged.get_frequencies() == whole.get_frequencies()
+
+
+def test_buckets():
+    density = SpectralDensity(min_dbm=-100, max_dbm=-50, resolution_db=10)
+    density.add(spectrum_sample(0.0, 0, [-95, -75, -200, 0]))  # out of range: clamped to the first / last bucket
+    assert list(density.get_density().values()) == [[1, 0, 0, 0, 0], [0, 0, 1, 0, 0],
+                                                    [1, 0, 0, 0, 0], [0, 0, 0, 0, 1]]
+    assert density.get_bucket_dbm(2) == -75
+    with pytest.raises(Exception, match="merge"):
+        density.merge(SpectralDensity())
+    with pytest.raises(Exception, match="SpectralDensity"):
+        SpectralDensity.from_bytes(b"ASC2" + density.to_bytes()[4:])
+
+
+def test_channels_are_merged_on_the_grid():
+    # channel 1 and 3 overlap at 24 sub-carriers, 5 GHz channels are on the grid
+    density = SpectralDensity()
+    density.add_samples([spectrum_sample(0.0, 0, [-50] * 56, freq=2412), spectrum_sample(0.0, 1, [-50] * 56, freq=2422),
+                         spectrum_sample(0.0, 2, [-50] * 56, freq=5180)])
+    frequencies = density.get_frequencies()
+    assert frequencies == [2403.25 + i * 0.3125 for i in range(88)] + [5171.25 + i * 0.3125 for i in range(56)]
+    assert [sum(row) for row in density.get_density().values()] == [1] * 32 + [2] * 24 + [1] * 32 + [1] * 56
+    assert SpectralDensity.from_bytes(density.to_bytes()).get_frequencies() == frequencies
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+""" Windows of SpectrumAggregator: tumbling and sliding, late samples. """
+
+import pytest
+from conftest import spectrum_sample
+from athspectralscan import AthSpectralScanDecoder, SpectrumAggregator
+
+
+def windows(results):
+    return [(r['start'], r['end'], r['count']) for r in results]
+
+
+def test_golden_tumbling(records):
+    samples = [sample for record in records for sample in AthSpectralScanDecoder._decode(record)]
+    aggregator = SpectrumAggregator(window_sec=1.0)
+    results = aggregator.add_samples(samples) + aggregator.flush()
+    assert sum(r['count'] for r in results) == len(samples)
+    for r in results:
+        assert list(r['max'].keys()) == list(samples[0][1][4].keys())
+        assert all(r['mean'][f] <= r['max'][f] for f in r['max'])
+
+
+def test_sliding_window():
+    # window of two panes, one window per hop, each window merges the panes within it
+    aggregator = SpectrumAggregator(window_sec=2.0, hop_sec=1.0, percentiles=(50,), duty_cycle_threshold=-65)
+    results = []
+    for (ts, value) in ((0.5, -50), (1.5, -60), (1.6, -60), (2.5, -70)):
+        results += aggregator.add(spectrum_sample(ts, int(ts * 1e6), [value] * 56))
+    assert windows(results) == [(-1.0, 1.0, 1), (0.0, 2.0, 3)]
+    results += aggregator.flush()
+    assert windows(results) == [(-1.0, 1.0, 1), (0.0, 2.0, 3), (1.0, 3.0, 3), (2.0, 4.0, 1)]
+    assert [list(r['max'].values())[0] for r in results] == [-50, -50, -60, -70]
+    assert [list(r['duty'].values())[0] for r in results] == pytest.approx([1, 1, 2 / 3, 0])
+    assert list(results[2]['percentiles'][50].values())[0] == -59.5  # center of the 1 dB bucket
+    assert list(results[1]['mean'].values())[0] == pytest.approx(-53.98, abs=0.01)  # linear mean
+
+
+def test_late_samples_are_dropped():
+    aggregator = SpectrumAggregator(window_sec=1.0)
+    aggregator.add(spectrum_sample(0.5, 0, [-50] * 56))
+    assert windows(aggregator.add(spectrum_sample(1.5, 1, [-50] * 56))) == [(0.0, 1.0, 1)]
+    assert aggregator.add(spectrum_sample(0.9, 2, [-50] * 56)) == []  # window 0..1 was already emitted
+    assert aggregator.late_samples == 1
+    assert windows(aggregator.flush()) == [(1.0, 2.0, 1)]
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+""" Round trips of the compressed spectrum encoding (CompressedSpectrumSink -> read_batches). """
+
+import io
+import random
+import pytest
+from collections import OrderedDict
+from conftest import ht20_packet, ht40_packet
+from athspectralscan import AthSpectralScanDecoder, CompressedSpectrumSink, SpectrumBatch, read_batches
+from athspectralscan.spectrumcodec import encode_batch, batch_header, FLAG_DELTA
+
+
+def round_trip(samples, **kwargs):
+    output = io.BytesIO()
+    sink = CompressedSpectrumSink(output, **kwargs)
+    sink.write_samples(samples)
+    sink.close()
+    output.seek(0)
+    return (sink, [sample for batch in read_batches(output) for sample in batch])
+
+
+def check(samples, decoded, step_db):
+    assert len(decoded) == len(samples)
+    for (sample, other) in zip(samples, decoded):
+        assert sample[0] == other[0]
+        assert sample[1][0:4] == other[1][0:4]
+        assert list(other[1][4].keys()) == pytest.approx(list(sample[1][4].keys()))
+        assert list(other[1][4].values()) == pytest.approx(list(sample[1][4].values()), abs=step_db / 2 + 1e-4)
+
+
+@pytest.mark.parametrize("step_db", [0.1, 0.5, 2.0])
+def test_golden_round_trip(records, step_db):
+    samples = [sample for record in records for sample in AthSpectralScanDecoder._decode(record)]
+    (sink, decoded) = round_trip(samples, batch_size=100, step_db=step_db)
+    check(samples, decoded, step_db)
+    assert sink.get_ratio() > 3
+
+
+@pytest.mark.parametrize("fidelity", [None, "decimated", "peak", "metadata"])
+def test_channels_and_fidelities(rnd, fidelity):
+    data = b"".join(rnd.choice((ht20_packet, ht40_packet))(rnd, freq=rnd.choice((2412, 2437, 5180)))
+                    for _ in range(300))
+    samples = list(AthSpectralScanDecoder._decode((1.5, data), fidelity=fidelity))
+    (sink, decoded) = round_trip(samples, batch_size=64)
+    check(samples, decoded, 0.5)
+
+
+def test_delta_encoding():
+    # the same spectrum with a drifting level (e.g. AGC): the deltas of the rows of a channel compress better
+    rnd = random.Random(1)
+    base = [rnd.uniform(-110, -60) for _ in range(56)]
+    samples = []
+    level = 0
+    for n in range(200):
+        freq = (2412, 2437)[n % 2]
+        level += rnd.choice((-1.5, -1, 1, 1.5))
+        pwr = OrderedDict((freq - 8.75 + i * 0.3125, v + level) for i, v in enumerate(base))
+        samples.append((100.0, (1000 * n, freq, -95, 10, pwr)))
+    batch = encode_batch(samples)
+    assert batch_header.unpack_from(batch)[4] & FLAG_DELTA
+    check(samples, list(SpectrumBatch.from_bytes(batch)), 0.5)
+
+
+def test_arrays(records):
+    samples = [sample for record in records for sample in AthSpectralScanDecoder._decode(record)]
+    batch = SpectrumBatch.from_bytes(encode_batch(samples, step_db=0.5))
+    assert len(batch) == len(samples)
+    assert list(batch.tsf) == [sample[1][0] for sample in samples]
+    assert list(batch.nbins) == [56] * len(samples)
+    assert len(batch.pwr) == 56 * len(samples)
+    assert list(batch.row(7)) == pytest.approx(list(samples[7][1][4].values()), abs=0.25 + 1e-4)
+    assert batch.first[0] == samples[0][1][1] - 8.75
+
+
+def test_tsf_wrap():
+    pwr = OrderedDict([(2403.25, -90.0), (2403.5625, -91.0)])
+    samples = [(0.0, (tsf, 2412, -95, 0, pwr)) for tsf in (2 ** 64 - 2, 2 ** 64 - 1, 0, 5)]
+    assert [sample[1][0] for sample in SpectrumBatch.from_bytes(encode_batch(samples))] == [2 ** 64 - 2, 2 ** 64 - 1, 0, 5]
+
+
+def test_invalid():
+    with pytest.raises(Exception):
+        SpectrumBatch.from_bytes(b"XXXX" + bytes(20))
+    with pytest.raises(Exception):
+        CompressedSpectrumSink(io.BytesIO(), step_db=0)
+    output = io.BytesIO()
+    sink = CompressedSpectrumSink(output)
+    sink.close()
+    assert output.getvalue() == b""
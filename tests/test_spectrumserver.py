@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+""" SpectrumServer / SpectrumClient: fan-out of decoded samples, events and raw chunks over a local socket. """
+
+import time
+import queue
+import socket
+import threading
+import pytest
+from conftest import dump_file, ht40_packet
+from athspectralscan import AthSpectralScanDecoder, DataHub, LoadController, SpectrumServer, SpectrumClient
+
+
+def wait_for(condition, timeout=10):
+    end = time.time() + timeout
+    while not condition():
+        if time.time() > end:
+            raise Exception("timeout")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = SpectrumServer(str(tmp_path / "spectrum.sock"))
+    server.start()
+    yield server
+    server.stop()
+
+
+def subscribe(server, n, **kwargs):
+    before = server.get_number_of_subscribers()
+    clients = [SpectrumClient(server.address, **kwargs) for _ in range(n)]
+    wait_for(lambda: server.get_number_of_subscribers() == before + n)
+    return clients
+
+
+def read_all(clients):
+    # read in background until the server closes the connections, returns the lists of received items
+    results = [[] for _ in clients]
+    threads = [threading.Thread(target=result.extend, args=(client,)) for client, result in zip(clients, results)]
+    for thread in threads:
+        thread.start()
+    return (threads, results)
+
+
+@pytest.fixture
+def samples(records):
+    return [sample for record in records for sample in AthSpectralScanDecoder._decode(record)]
+
+
+def test_round_trip(server, samples):
+    clients = subscribe(server, 2)
+    (threads, results) = read_all(clients)
+    output_queue = queue.Queue()
+    for sample in samples:
+        output_queue.put(sample)
+    event = (100, 200, 2403.25, 2420.75, -42.5)
+    output_queue.put(event)
+    output_queue.put(AthSpectralScanDecoder.end_of_stream_marker)
+    server.attach(output_queue)
+    server.pump_thread.join()
+    server.stop()
+    for (thread, client, received) in zip(threads, clients, results):
+        thread.join()
+        assert len(received) == len(samples) + 1
+        for (sample, other) in zip(samples, received):
+            assert other[1][0:4] == sample[1][0:4]
+            assert list(other[1][4].keys()) == list(sample[1][4].keys())
+            assert list(other[1][4].values()) == pytest.approx(list(sample[1][4].values()), abs=1e-4)  # float32
+        assert received[-1] == event
+        client.close()
+
+
+
+@pytest.mark.parametrize("fidelity", ["decimated", "peak", "metadata"])
+def test_round_trip_fidelity(server, records, rnd, fidelity):
+    # the reduced fidelities of LoadController: the bins are not a contiguous grid, the samples are tagged
+    chunks = records + [(1.0, b"".join(ht40_packet(rnd) for _ in range(20)))]
+    samples = [sample + (fidelity,) for chunk in chunks
+               for sample in AthSpectralScanDecoder._decode(chunk, fidelity=fidelity, decimation=4)]
+    (client,) = subscribe(server, 1)
+    (threads, (received,)) = read_all([client])
+    for sample in samples:
+        server.publish(sample)
+    server.stop()
+    threads[0].join()
+    assert len(received) == len(samples)
+    for (sample, other) in zip(samples, received):
+        assert other[1][0:4] == sample[1][0:4]
+        assert other[2] == fidelity
+        assert list(other[1][4].keys()) == list(sample[1][4].keys())
+        assert list(other[1][4].values()) == pytest.approx(list(sample[1][4].values()), abs=1e-4)
+    client.close()
+
+
+def test_load_controller(server, samples):
+    decoder = AthSpectralScanDecoder()
+    decoder.set_backend("inline")
+    output_queue = queue.Queue()
+    decoder.set_output_queue(output_queue)
+    decoder.set_end_of_stream_marker(True)
+    decoder.set_load_controller(LoadController())
+    decoder.start()
+    (client,) = subscribe(server, 1)
+    (threads, (received,)) = read_all([client])
+    server.attach(output_queue)
+    hub = DataHub(dump_file_in=dump_file, decoder=decoder)
+    hub.start()
+    server.pump_thread.join()
+    hub.stop()
+    server.stop()
+    threads[0].join()
+    assert len(received) == len(samples)
+    assert all(sample[2] == "full" for sample in received)  # no load
+    assert [list(sample[1][4].keys()) for sample in received] == [list(sample[1][4].keys()) for sample in samples]
+    client.close()
+
+def test_raw(server, records):
+    (client,) = subscribe(server, 1, kind="raw")
+    for (ts, data) in records:
+        server.write_chunk(ts, data)  # sink interface of DataHub
+    server.publish((0.0, (1, 2412, -95, 0, dict())))  # not subscribed
+    server.stop()
+    assert list(client) == records
+    client.close()
+
+
+def test_decimate_and_filter(server, samples):
+    clients = subscribe(server, 1, decimate=3) + subscribe(server, 1, freq=2437) + \
+        subscribe(server, 1, freq=[2400, 2420])
+    (threads, (every_3rd, other_channel, channel)) = read_all(clients)
+    for sample in samples:  # all on 2412 MHz
+        server.publish(sample)
+    server.publish_event((1, 2, 2430.0, 2444.0, -50.0))  # 2437 MHz, events are not decimated
+    server.stop()
+    for thread in threads:
+        thread.join()
+    assert [s[1][0] for s in every_3rd[:-1]] == [s[1][0] for s in samples[::3]]
+    assert every_3rd[-1] == (1, 2, 2430.0, 2444.0, -50.0)
+    assert other_channel == [(1, 2, 2430.0, 2444.0, -50.0)]
+    assert [s[1][0] for s in channel] == [s[1][0] for s in samples]
+    for client in clients:
+        client.close()
+
+
+def test_slow_subscriber_drops_frames(server):
+    (client,) = subscribe(server, 1, kind="raw", queue_size=2)
+    data = bytes(256 * 1024)
+    for n in range(100):
+        server.publish_raw(float(n), data)  # never blocks
+    subscriber = server.subscribers[0]
+    assert subscriber.dropped > 0
+    received = []
+    reader = threading.Thread(target=lambda: received.extend(client))
+    reader.start()
+    server.stop()
+    reader.join()
+    assert 0 < len(received) < 100
+    assert [ts for (ts, d) in received] == sorted(ts for (ts, d) in received)
+    client.close()
+
+
+def test_stop_with_a_subscriber_which_does_not_read(server):
+    (client,) = subscribe(server, 1, kind="raw", queue_size=1000)
+    data = bytes(1024 * 1024)
+    for n in range(20):
+        server.publish_raw(float(n), data)
+    wait_for(lambda: server.subscribers[0].queue.qsize() < 20)  # the sender is blocked in sendall()
+    t_start = time.time()
+    server.stop()
+    assert time.time() - t_start < SpectrumServer.close_timeout_sec + 5
+    assert server.get_number_of_subscribers() == 0
+    client.close()
+
+
+def test_silent_client_does_not_block_others(server, samples):
+    silent = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    silent.connect(server.address)  # sends no subscription
+    t_start = time.time()
+    (client,) = subscribe(server, 1)
+    assert time.time() - t_start < 1
+    (threads, (received,)) = read_all([client])
+    for sample in samples[0:10]:
+        server.publish(sample)
+    t_start = time.time()
+    server.stop()
+    assert time.time() - t_start < SpectrumServer.handshake_timeout_sec
+    threads[0].join()
+    assert [s[1][0] for s in received] == [s[1][0] for s in samples[0:10]]
+    assert silent.recv(1) == b""  # closed by the server
+    silent.close()
+    client.close()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+##
+## This file is part of the athspectralscan project.
+##
+## Copyright (C) 2016-2017 Robert Felten - https://github.com/rfelten/
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+""" TSFClock: TSF to host time, short repeat, resets and wraps of the TSF counter. """
+
+import pytest
+from athspectralscan import TSFClock
+
+
+def chunk(ts, tsfs):
+    # the samples of one chunk share the time stamp of DataHub
+    return [(ts, (tsf, 2412, -95, 20, dict())) for tsf in tsfs]
+
+
+def test_tsf_to_host_time():
+    clock = TSFClock()
+    samples = clock.process(chunk(100.0, [1000000, 1000500, 1001000]) + chunk(100.1, [1100000]))
+    # the last sample of the first chunk is the anchor, the others are placed relative to it by their TSF. The second
+    # chunk was read 1 ms later than its TSF says: the ts is an upper bound, so the clock keeps the earlier offset
+    assert [s[0] for s in samples] == pytest.approx([99.999, 99.9995, 100.0, 100.099])
+    assert [s[1] for s in samples] == [s[1] for s in chunk(0, [1000000, 1000500, 1001000, 1100000])]
+
+
+def test_short_repeat():
+    samples = chunk(100.0, [1000000, 1000000, 1000000, 1000100])
+    assert [s[1][0] for s in TSFClock().process(samples)] == [1000000, 1000000, 1000000, 1000100]
+    clock = TSFClock(short_repeat=True)
+    corrected = clock.process(samples)
+    assert [s[1][0] for s in corrected] == [1000000, 1000004, 1000008, 1000100]
+    assert corrected[2][0] - corrected[0][0] == pytest.approx(8e-6)
+
+
+def test_reset():
+    clock = TSFClock()
+    clock.process(chunk(100.0, [50000000]) + chunk(100.1, [50100000]))
+    # interface down / up: the TSF starts again near 0, the fit restarts at the host time of the chunk
+    samples = clock.process(chunk(100.2, [1000, 2000]) + chunk(100.3, [102000]))
+    assert clock.resets == 1
+    assert [s[0] for s in samples] == pytest.approx([100.199, 100.2, 100.3])
+    # a jump forward which is not explained by the host time is a reset as well
+    clock.process(chunk(100.4, [900000000]))
+    assert clock.resets == 2
+
+
+def test_wrap():
+    clock = TSFClock(tsf_bits=32)
+    samples = clock.process(chunk(100.0, [2 ** 32 - 50000]) + chunk(100.1, [50000]))
+    assert clock.resets == 0
+    assert [s[0] for s in samples] == pytest.approx([100.0, 100.1])
+
+
+def test_wrap_inside_a_chunk():
+    clock = TSFClock(tsf_bits=32)
+    samples = clock.process(chunk(100.0, [2 ** 32 - 100, 50]) + chunk(100.1, [100050]))
+    assert clock.resets == 0
+    assert [s[0] for s in samples] == pytest.approx([99.99985, 100.0, 100.1])
+    assert [s[1][0] for s in samples] == [2 ** 32 - 100, 50, 100050]  # the TSF is passed through
+    assert clock.to_host_time(100050) == pytest.approx(100.1)